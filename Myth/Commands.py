@@ -1,4 +1,6 @@
 import os
+import sys
+from array import array
 
 from PySide2.QtGui import *
 from PySide2.QtCore import *
@@ -14,7 +16,27 @@ class CommandIgnored(ValueError):
         super().__init__(message)
 
 
-class CommandSetResolution(QUndoCommand):
+class Command(QUndoCommand):
+    """
+    Base of the undo commands. Commands can tell how much memory their state takes,
+    the stacks themselves are bounded by their undo limit.
+    """
+
+    def memoryEstimate(self):
+        """
+        Bytes taken by the state the command keeps, as sys.getsizeof gives them. The
+        window, stores and sprites it refers to belong to the sheets and aren't counted.
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+        for value in self.__dict__.values():
+            if isinstance(value, dict):
+                size += sys.getsizeof(value) + sum(map(sys.getsizeof, value.values()))
+            elif isinstance(value, (array, str, tuple, list)):
+                size += sys.getsizeof(value)
+        return size
+
+
+class CommandSetResolution(Command):
     def __init__(self, mainwin, new):
         super().__init__()
 
@@ -34,7 +56,7 @@ class CommandSetResolution(QUndoCommand):
         self.win.statusBar().showMessage(f"Set resolution from {self.new} to {self.prev}")
 
 
-class CommandSetImage(QUndoCommand):
+class CommandSetImage(Command):
     def __init__(self, mainwin, new):
         super().__init__()
 
@@ -46,11 +68,11 @@ class CommandSetImage(QUndoCommand):
             raise CommandIgnored("Selected image has already been loaded, ignoring")
 
     def do(self, new):
-        if self.win.loadImage(new):
-            self.win.spritesList.model().sheet().setBasepath(os.path.dirname(new))
-            self.win.spritesList.model().sheet().setSource(os.path.basename(new))
-        else:
+        # NOTE: the new image has already been loaded when the command is pushed
+        if new != self.win.currentImage and not self.win.loadImage(new):
             raise CommandError(f"Failed to load image {new}")
+        self.win.spritesList.model().sheet().setBasepath(os.path.dirname(new))
+        self.win.spritesList.model().sheet().setSource(os.path.basename(new))
 
     def redo(self):
         self.do(self.new)
@@ -59,7 +81,7 @@ class CommandSetImage(QUndoCommand):
         self.do(self.prev)
 
 
-class CommandCreateSprite(QUndoCommand):
+class CommandCreateSprite(Command):
     def __init__(self, mainwin, sprite):
         super().__init__()
 
@@ -82,7 +104,7 @@ class CommandCreateSprite(QUndoCommand):
         self.win.statusBar().showMessage(f"Deleted sprite {self.sprite.name()}")
 
 
-class CommandDeleteSprite(QUndoCommand):
+class CommandDeleteSprite(Command):
     def __init__(self, mainwin, sprite):
         super().__init__()
 
@@ -102,7 +124,10 @@ class CommandDeleteSprite(QUndoCommand):
             QMessageBox.warning(self.win, self.win.windowTitle, f"Duplicate sprite name: {self.sprite.name()}")
 
 
-class CommandModifySprite(QUndoCommand):
+class CommandModifySprite(Command):
+    # NOTE: consecutive edits of the same sprite (e.g. nudging it around) merge into one
+    mergeId = 1
+
     def __init__(self, mainwin, sprite, x, y, w, h, name=None):
         super().__init__()
 
@@ -112,6 +137,9 @@ class CommandModifySprite(QUndoCommand):
         self.newName = name
         self.prevName = sprite.name()
 
+        if name and name != self.prevName and self.win.spritesList.model().findDupes(name):
+            raise CommandError(f"Duplicate sprite name: {name}")
+
         self.newSize = {
             "x": x,
             "y": y,
@@ -126,20 +154,37 @@ class CommandModifySprite(QUndoCommand):
             "h": sprite.height()
         }
 
+    def id(self):
+        return self.mergeId
+
+    def mergeWith(self, other):
+        if other.sprite != self.sprite:
+            return False
+
+        self.newSize = other.newSize
+        if other.newName:
+            self.newName = other.newName
+        return True
+
     def redo(self):
-        self.sprite.setSize(**self.newSize)
-        if self.newName:
-            self.sprite.setName(self.newName)
-        self.win.repaint()
+        self.apply(self.newSize, self.newName)
         self.win.statusBar().showMessage(f"Modified sprite {self.sprite.name()}")
 
     def undo(self):
-        self.sprite.setSize(**self.oldSize)
-        self.sprite.setName(self.prevName)
-        self.win.repaint()
+        self.apply(self.oldSize, self.prevName)
         self.win.statusBar().showMessage(f"Un-modified sprite {self.sprite.name()}")
 
-class CommandFlipSprite(QUndoCommand):
+    def apply(self, size, name):
+        old = (self.sprite.x(), self.sprite.y(), self.sprite.width(), self.sprite.height())
+        self.sprite.setSize(**size)
+        if name and name != self.sprite.name():
+            self.sprite.setName(name)
+            self.win.repaint()
+        else:
+            new = (self.sprite.x(), self.sprite.y(), self.sprite.width(), self.sprite.height())
+            self.win.repaintSpriteArea(old, new)
+
+class CommandFlipSprite(Command):
     def __init__(self, mainwin, sprite, axis):
         super().__init__()
 
@@ -165,3 +210,133 @@ class CommandFlipSprite(QUndoCommand):
     def undo(self):
         self.flipAxis()
         self.win.statusBar().showMessage(f"Un-flipped sprite {self.sprite.name()}")
+
+
+class _CommandSprites(Command):
+    """
+    Base of the commands working on a set of sprites. The sprites are kept as an
+    array of slots of their store, instead of a list of Sprite objects.
+    """
+    def __init__(self, mainwin, sprites):
+        super().__init__()
+
+        if not sprites:
+            raise CommandIgnored("No sprites selected, ignoring")
+
+        self.win = mainwin
+        self.store = sprites[0].store()
+        self.slots = array("i", (spr.slot() for spr in sprites))
+
+    def sprites(self):
+        return [self.store.view(slot) for slot in self.slots]
+
+
+class CommandTranslateSprites(_CommandSprites):
+    # NOTE: consecutive moves of the same sprites merge into one
+    mergeId = 2
+
+    def __init__(self, mainwin, sprites, dx, dy):
+        super().__init__(mainwin, sprites)
+
+        if dx == 0 and dy == 0:
+            raise CommandIgnored("Sprites would not move, ignoring")
+
+        self.dx = dx
+        self.dy = dy
+
+    def id(self):
+        return self.mergeId
+
+    def mergeWith(self, other):
+        if other.store is not self.store or other.slots != self.slots:
+            return False
+
+        self.dx += other.dx
+        self.dy += other.dy
+        return True
+
+    def move(self, dx, dy):
+        store = self.store
+        for slot in self.slots:
+            x, y, w, h = store.geometry(slot)
+            store.setGeometry(slot, x + dx, y + dy, w, h)
+        self.win.repaint()
+
+    def redo(self):
+        self.move(self.dx, self.dy)
+        self.win.statusBar().showMessage(f"Moved {len(self.slots)} sprites by {self.dx}, {self.dy}")
+
+    def undo(self):
+        self.move(-self.dx, -self.dy)
+        self.win.statusBar().showMessage(f"Moved {len(self.slots)} sprites back")
+
+
+class CommandResizeSprites(_CommandSprites):
+    def __init__(self, mainwin, sprites, w, h):
+        super().__init__(mainwin, sprites)
+
+        if w <= 0 or h <= 0:
+            raise CommandError(f"Invalid sprite size: {w}x{h}")
+
+        self.w = w
+        self.h = h
+        # Previous width and height of every sprite, interleaved
+        self.oldSizes = array("i")
+        for slot in self.slots:
+            self.oldSizes.append(self.store.width(slot))
+            self.oldSizes.append(self.store.height(slot))
+
+    def redo(self):
+        store = self.store
+        for slot in self.slots:
+            store.setGeometry(slot, store.x(slot), store.y(slot), self.w, self.h)
+        self.win.repaint()
+        self.win.statusBar().showMessage(f"Resized {len(self.slots)} sprites to {self.w}x{self.h}")
+
+    def undo(self):
+        store = self.store
+        sizes = self.oldSizes
+        for i, slot in enumerate(self.slots):
+            store.setGeometry(slot, store.x(slot), store.y(slot), sizes[2*i], sizes[2*i + 1])
+        self.win.repaint()
+        self.win.statusBar().showMessage(f"Un-resized {len(self.slots)} sprites")
+
+
+class CommandFlipSprites(_CommandSprites):
+    def __init__(self, mainwin, sprites, axis):
+        super().__init__(mainwin, sprites)
+
+        if axis not in [ "x", "y" ]:
+            raise CommandError(f"Unsupported axis, expected x or y: {axis}")
+
+        self.axis = axis
+
+    def flipAxis(self):
+        flip = self.store.flipX if self.axis == "x" else self.store.flipY
+        for slot in self.slots:
+            flip(slot)
+        self.win.repaint()
+
+    def redo(self):
+        self.flipAxis()
+        self.win.statusBar().showMessage(f"Flipped {len(self.slots)} sprites")
+
+    def undo(self):
+        self.flipAxis()
+        self.win.statusBar().showMessage(f"Un-flipped {len(self.slots)} sprites")
+
+
+class CommandDeleteSprites(_CommandSprites):
+    def redo(self):
+        self.win.spritesList.model().removeSprites(self.sprites())
+        self.win.repaint()
+        self.win.statusBar().showMessage(f"Deleted {len(self.slots)} sprites")
+
+    def undo(self):
+        added = self.win.spritesList.model().insertSprites(self.sprites())
+        self.win.repaint()
+        if len(added) == len(self.slots):
+            self.win.statusBar().showMessage(f"Added {len(added)} sprites")
+        else:
+            QMessageBox.warning(self.win, self.win.windowTitle,
+                                f"Could not add {len(self.slots) - len(added)} sprites with duplicate names")
@@ -0,0 +1,157 @@
+import os
+
+from PySide2 import QtCore
+from PySide2.QtCore import *
+
+import Myth.Util
+
+
+class DocumentWatcher(QObject):
+    """
+    Watches the open stylesheet and the displayed image for changes made outside of
+    the program.
+
+    Changes are first checked against a stat fingerprint (see Myth.Util.fileFingerprint),
+    the stylesheet is only hashed when that differs, so touching a file or our own
+    saves don't count as changes. Notifications are debounced, since tools usually
+    write files in several steps, and files replaced by a rename are watched again
+    once the new file appears.
+    """
+    stylesheetChanged = QtCore.Signal(str)
+    imageChanged = QtCore.Signal(str)
+
+    debounceMs = 250
+    # How many times to look for a file which disappeared, before giving up on it
+    maxRetries = 8
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self._cb_fileChanged)
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.debounceMs)
+        self._timer.timeout.connect(self._cb_checkPending)
+
+        self._stylesheet = None
+        self._stylesheetFingerprint = None
+        self._stylesheetDigest = None
+        # Digest of the last change we notified about, so it's only reported once
+        self._notifiedDigest = None
+
+        self._image = None
+        self._imageFingerprint = None
+
+        # path -> number of checks done while the file was missing
+        self._pending = {}
+
+    def _watch(self, path):
+        if path and os.path.exists(path) and path not in self._watcher.files():
+            self._watcher.addPath(path)
+
+    def _unwatch(self, path):
+        if path and path not in (self._stylesheet, self._image) and path in self._watcher.files():
+            self._watcher.removePath(path)
+
+    def stylesheet(self):
+        return self._stylesheet
+
+    def setStylesheet(self, filename, digest):
+        """
+        Starts watching the stylesheet, whose contents are currently the given digest.
+        Also called after saving, so our own writes aren't reported as changes.
+        """
+        prev = self._stylesheet
+        self._stylesheet = filename
+        self._unwatch(prev)
+
+        self._stylesheetFingerprint = Myth.Util.fileFingerprint(filename) if filename else None
+        self._stylesheetDigest = digest
+        self._notifiedDigest = None
+        self._pending.pop(filename, None)
+        self._watch(filename)
+
+    def setImage(self, filename):
+        prev = self._image
+        self._image = filename
+        self._unwatch(prev)
+
+        self._imageFingerprint = Myth.Util.fileFingerprint(filename) if filename else None
+        self._pending.pop(filename, None)
+        self._watch(filename)
+
+    def clear(self):
+        self.setStylesheet(None, None)
+        self.setImage(None)
+        self._pending.clear()
+
+    def isStylesheetModified(self):
+        """
+        Checks whether the stylesheet differs from the digest it was last loaded or saved with.
+        Only hashes the file if the fingerprint changed.
+        """
+        return self._changedDigest() is not None
+
+    def _changedDigest(self):
+        """ Returns the new digest of the stylesheet ("" if it can't be read), or None if unchanged. """
+        if not self._stylesheet:
+            return None
+
+        fp = Myth.Util.fileFingerprint(self._stylesheet)
+        if fp is None:
+            return ""
+        if fp == self._stylesheetFingerprint:
+            return None
+
+        try:
+            digest = Myth.Util.checksumFile(self._stylesheet)
+        except OSError:
+            return ""
+
+        if digest == self._stylesheetDigest:
+            # Touched or rewritten with the same contents
+            self._stylesheetFingerprint = fp
+            return None
+        return digest
+
+    def _cb_fileChanged(self, path):
+        self._pending.setdefault(path, 0)
+        self._timer.start()
+
+    def _cb_checkPending(self):
+        pending = self._pending
+        self._pending = {}
+
+        for path, tries in pending.items():
+            if not os.path.exists(path):
+                # Most likely replaced by a rename which hasn't finished yet
+                if tries < self.maxRetries and path in (self._stylesheet, self._image):
+                    self._pending[path] = tries + 1
+                continue
+
+            # NOTE: the watch is dropped when a file is replaced by a rename
+            self._watch(path)
+
+            if path == self._stylesheet:
+                self._checkStylesheet()
+            if path == self._image:
+                self._checkImage()
+
+        if self._pending:
+            self._timer.start()
+
+    def _checkStylesheet(self):
+        digest = self._changedDigest()
+        if digest and digest != self._notifiedDigest:
+            self._notifiedDigest = digest
+            self.stylesheetChanged.emit(self._stylesheet)
+
+    def _checkImage(self):
+        fp = Myth.Util.fileFingerprint(self._image)
+        if fp is None or fp == self._imageFingerprint:
+            return
+
+        self._imageFingerprint = fp
+        self.imageChanged.emit(self._image)
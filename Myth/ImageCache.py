@@ -0,0 +1,80 @@
+import os
+from collections import OrderedDict
+
+
+class ImageCache:
+    """
+    Least recently used cache of decoded images with a memory budget.
+
+    Entries are keyed by the resolved path together with the file's mtime and size,
+    so a file changed on disk is never served from the cache.
+    """
+
+    def __init__(self, budget=512 * 1024 * 1024):
+        self._budget = budget
+        self._used = 0
+        # key -> (image, size in bytes), least recently used first
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def keyFor(filename):
+        """ Returns the cache key for a file, or None if the file can't be stat'd. """
+        try:
+            path = os.path.realpath(filename)
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (path, st.st_mtime_ns, st.st_size)
+
+    def budget(self):
+        return self._budget
+
+    def setBudget(self, budget):
+        self._budget = budget
+        self._evict()
+
+    def used(self):
+        return self._used
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        if key is None:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, image):
+        if key is None:
+            return
+
+        size = image.sizeInBytes()
+        if size > self._budget:
+            return
+
+        old = self._entries.pop(key, None)
+        if old:
+            self._used -= old[1]
+
+        # Drop stale entries of the same file
+        for k in [k for k in self._entries if k[0] == key[0]]:
+            self._used -= self._entries.pop(k)[1]
+
+        self._entries[key] = (image, size)
+        self._used += size
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self._used = 0
+
+    def _evict(self):
+        while self._used > self._budget and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._used -= size
@@ -0,0 +1,139 @@
+from PySide2 import QtCore
+from PySide2.QtGui import *
+from PySide2.QtCore import *
+
+from Myth.ImageCache import ImageCache
+
+
+class _LoadSignals(QObject):
+    # request id, percentage read or -1 while decoding
+    progress = QtCore.Signal(int, int)
+    # request id, image, error message (empty on success)
+    finished = QtCore.Signal(int, QImage, str)
+
+
+class _LoadJob(QRunnable):
+    """
+    Reads an image file in chunks and decodes it, on a thread pool thread.
+    Cancellation is checked between chunks; decoding itself can't be interrupted,
+    so a job canceled during decoding just has it's result ignored.
+    """
+    chunkSize = 1024 * 1024
+
+    def __init__(self, requestId, filename, cacheKey, signals):
+        super().__init__()
+        self.requestId = requestId
+        self.filename = filename
+        self.cacheKey = cacheKey
+        self.signals = signals
+        self.cancelled = False
+
+    def run(self):
+        try:
+            data = QByteArray()
+            with open(self.filename, "rb") as fd:
+                fd.seek(0, 2)
+                total = fd.tell() or 1
+                fd.seek(0)
+
+                while True:
+                    if self.cancelled:
+                        return
+                    chunk = fd.read(self.chunkSize)
+                    if not chunk:
+                        break
+                    data.append(chunk)
+                    self.signals.progress.emit(self.requestId, int(data.size() * 100 / total))
+
+            self.signals.progress.emit(self.requestId, -1)
+
+            buf = QBuffer(data)
+            buf.open(QIODevice.ReadOnly)
+
+            reader = QImageReader(buf)
+            img = reader.read()
+            if img.isNull():
+                self.signals.finished.emit(self.requestId, QImage(), reader.errorString())
+            else:
+                self.signals.finished.emit(self.requestId, img, "")
+        except OSError as e:
+            self.signals.finished.emit(self.requestId, QImage(), str(e))
+
+
+class ImageLoader(QObject):
+    """
+    Decodes images on a worker thread so the GUI stays responsive while large
+    spritesheets are loading. Only the most recently requested image is delivered,
+    starting a new load cancels the previous one.
+
+    Decoded images are kept in an ImageCache, images which are in the cache and
+    haven't changed on disk are delivered immediately without decoding.
+    """
+    # filename, percentage read or -1 while decoding
+    progress = QtCore.Signal(str, int)
+    loaded = QtCore.Signal(str, QImage)
+    failed = QtCore.Signal(str, str)
+    canceled = QtCore.Signal(str)
+
+    def __init__(self, parent=None, cacheBudget=512 * 1024 * 1024):
+        super().__init__(parent)
+
+        self._cache = ImageCache(cacheBudget)
+        self._pool = QThreadPool(self)
+        self._signals = _LoadSignals()
+        self._signals.progress.connect(self._cb_progress)
+        self._signals.finished.connect(self._cb_finished)
+
+        self._job = None
+        self._nextId = 0
+
+    def isLoading(self):
+        return self._job is not None
+
+    def filename(self):
+        return self._job.filename if self._job else None
+
+    def cache(self):
+        return self._cache
+
+    def load(self, filename):
+        if self._job:
+            self._job.cancelled = True
+            self._job = None
+
+        key = ImageCache.keyFor(filename)
+        image = self._cache.get(key)
+        if image is not None:
+            self.loaded.emit(filename, image)
+            return
+
+        self._nextId += 1
+        self._job = _LoadJob(self._nextId, filename, key, self._signals)
+        self._pool.start(self._job)
+
+    def cancel(self):
+        if not self._job:
+            return
+
+        self._job.cancelled = True
+        filename = self._job.filename
+        self._job = None
+        self.canceled.emit(filename)
+
+    def _cb_progress(self, requestId, percent):
+        if self._job and self._job.requestId == requestId:
+            self.progress.emit(self._job.filename, percent)
+
+    def _cb_finished(self, requestId, image, error):
+        if not self._job or self._job.requestId != requestId:
+            return
+
+        filename = self._job.filename
+        key = self._job.cacheKey
+        self._job = None
+
+        if error:
+            self.failed.emit(filename, error)
+        else:
+            self._cache.put(key, image)
+            self.loaded.emit(filename, image)
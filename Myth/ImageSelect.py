@@ -1,57 +1,256 @@
+import math
+import time
+from collections import OrderedDict
+
 from PySide2 import QtCore, QtGui
 from PySide2.QtGui import *
 from PySide2.QtCore import *
 from PySide2.QtWidgets import *
 
+from Myth.Util import FrameTimer
+
+
+class ImageSelect(QWidget):
+    """
+    Canvas displaying the spritesheet image, on which sprites are drawn with the mouse.
+    A rectangle started with shift held selects the sprites inside it instead, and
+    ctrl+click toggles the selection of the sprite under the cursor.
+
+    The image is split into tiles, and a pyramid of pre-downscaled levels (each half
+    the size of the previous one) is built on demand. Painting only draws the tiles
+    intersecting the exposed area, from the level closest to the current zoom, so the
+    cost of a paint depends on the viewport size instead of the image size.
+    """
 
-class ImageSelect(QLabel):
     paintFinished = QtCore.Signal(QPaintEvent)
     paintStarted = QtCore.Signal(QPaintEvent)
     rectFinished = QtCore.Signal(QPainter)
     rectStarted = QtCore.Signal(QPoint)
+    selectionRectFinished = QtCore.Signal(QRect)
+    selectionToggled = QtCore.Signal(QPoint)
     contextMenu = QtCore.Signal(QPoint)
 
     scale = (1.0, 1.0)
     cursor_pos = None
     selection_start = None
+    # Whether the rectangle being drawn selects sprites instead of creating one
+    selecting = False
 
     textBgBrush = QBrush(Qt.white)
     selLinePen = QPen(Qt.black, 2)
 
+    tileSize = 512
+    maxTiles = 64
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
         self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
-        self.setScaledContents(True)
         self.setMouseTracking(True)
 
+        self._image = None
+        self._size = QSize()
+        self._flip = (False, False)
+        self._lowMemory = False
+        # Level number -> downscaled copy of the image, level 0 is the image itself
+        self._levels = {}
+        # (level, tx, ty) -> QPixmap, least recently used first
+        self._tiles = OrderedDict()
+
         selDashes = [1, 4]
         self.selRectBlackLinePen = QPen(Qt.black, 1, Qt.CustomDashLine)
         self.selRectBlackLinePen.setDashPattern(selDashes)
         self.selRectWhiteLinePen = QPen(Qt.white, 1, Qt.CustomDashLine)
         self.selRectWhiteLinePen.setDashPattern(list(reversed(selDashes)))
 
-    def setPixmap(self, pixmap, flipX=False, flipY=False):
-        tr = QTransform()
-        if flipX:
-            tr.scale(-1.0, 1.0)
-        if flipY:
-            tr.scale(1.0, -1.0)
-        return super().setPixmap(pixmap.transformed(tr))
+        self.frameTimer = FrameTimer()
+        # Widget area covered by the crosshair, selection rect and dimension label
+        # during the last paint, which needs to be invalidated when they move.
+        self._overlayRegion = QRegion()
+
+    def setImage(self, image, flipX=False, flipY=False):
+        """
+        Displays the image. The image is not copied, flipping is applied when drawing.
+        """
+        self._image = image
+        self._size = image.size()
+        self._levels = {0: image}
+        self._tiles.clear()
+        self._flip = (flipX, flipY)
+
+        self.resize(self.sizeHint())
+        self._overlayRegion = self._computeOverlayRegion()
+        self.update()
+
+    def setPlaceholder(self, size):
+        """
+        Drops the current image but keeps a canvas of the given size, so sprites can
+        still be displayed and drawn while the image is loading.
+        """
+        self._image = None
+        self._size = QSize(size)
+        self._levels = {}
+        self._tiles.clear()
+
+        self.resize(self.sizeHint())
+        self._overlayRegion = self._computeOverlayRegion()
+        self.update()
+
+    def image(self):
+        return self._image
+
+    def hasImage(self):
+        return self._image is not None and not self._image.isNull()
+
+    def imageSize(self):
+        return self._size
+
+    def hasCanvas(self):
+        return not self._size.isEmpty()
+
+    def setFlip(self, flipX, flipY):
+        self._flip = (flipX, flipY)
+        self.update()
 
     def flipX(self):
-        return self.setPixmap(self.pixmap(), True, False)
+        self.setFlip(not self._flip[0], self._flip[1])
 
     def flipY(self):
-        return self.setPixmap(self.pixmap(), False, True)
+        self.setFlip(self._flip[0], not self._flip[1])
+
+    def lowMemory(self):
+        return self._lowMemory
+
+    def setLowMemory(self, enabled):
+        """
+        In low memory mode no converted tiles are cached and only the pyramid level
+        currently in use is kept, at the cost of slower painting.
+        """
+        self._lowMemory = enabled
+        self._tiles.clear()
+        if self.hasImage():
+            self._levels = {0: self._image}
+        self.update()
+
+    def sizeHint(self):
+        if not self.hasCanvas():
+            return QSize()
+        return self.scale[0] * self.imageSize()
+
+    def _level(self, n):
+        img = self._levels.get(n)
+        if img is not None:
+            return img
+
+        if self._lowMemory:
+            # Drop the level we're switching from and scale straight from the image
+            self._levels = {0: self._image}
+            w = max(1, math.ceil(self._image.width() / 2**n))
+            h = max(1, math.ceil(self._image.height() / 2**n))
+            img = self._image.scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            self._levels[n] = img
+            return img
+
+        prev = self._level(n - 1)
+        w = max(1, (prev.width() + 1) // 2)
+        h = max(1, (prev.height() + 1) // 2)
+        img = prev.scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self._levels[n] = img
+        return img
+
+    def _levelForScale(self, scale):
+        """ Returns the smallest level which still has at least as many pixels as the screen. """
+        if scale >= 1.0:
+            return 0
+
+        n = int(math.floor(math.log2(1.0 / scale)))
+        # No point in going smaller than a single tile
+        size = self.imageSize()
+        maxLevel = max(0, math.ceil(math.log2(max(size.width(), size.height()) / self.tileSize)))
+        return min(n, maxLevel)
+
+    def _tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        ts = self.tileSize
+        img = self._level(level)
+        tile = QPixmap.fromImage(img.copy(QRect(tx * ts, ty * ts, ts, ts).intersected(img.rect())))
+        self._tiles[key] = tile
+        if len(self._tiles) > self.maxTiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def _paintTiles(self, painter, exposedRects):
+        scale = self.scale[0]
+        level = self._levelForScale(scale)
+        img = self._level(level)
+
+        # Widget pixels per level pixel, horizontally and vertically
+        kx = self._size.width() / img.width() * self.scale[0]
+        ky = self._size.height() / img.height() * self.scale[1]
+
+        painter.save()
+
+        # Mirror the painter instead of the pixels, along with the exposed rects
+        flipX, flipY = self._flip
+        if flipX or flipY:
+            w = round(self._size.width() * self.scale[0])
+            h = round(self._size.height() * self.scale[1])
+            painter.translate(w if flipX else 0, h if flipY else 0)
+            painter.scale(-1.0 if flipX else 1.0, -1.0 if flipY else 1.0)
+            exposedRects = [QRect(w - r.right() - 1 if flipX else r.left(),
+                                  h - r.bottom() - 1 if flipY else r.top(),
+                                  r.width(), r.height()) for r in exposedRects]
+
+        # The tiles of all the exposed rects, each only once
+        ts = self.tileSize
+        tiles = set()
+        for exposed in exposedRects:
+            tx0 = max(0, int(exposed.left() / kx) // ts)
+            ty0 = max(0, int(exposed.top() / ky) // ts)
+            tx1 = min((img.width() - 1) // ts, int(exposed.right() / kx) // ts)
+            ty1 = min((img.height() - 1) // ts, int(exposed.bottom() / ky) // ts)
+            tiles.update((tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1))
+
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, scale < 1.0)
+
+        for tx, ty in sorted(tiles):
+            source = QRect(tx * ts, ty * ts, ts, ts).intersected(img.rect())
+            # Round the edges, not the sizes, so neighbouring tiles never leave gaps
+            x0 = round(source.x() * kx)
+            y0 = round(source.y() * ky)
+            x1 = round((source.x() + source.width()) * kx)
+            y1 = round((source.y() + source.height()) * ky)
+            target = QRect(x0, y0, x1 - x0, y1 - y0)
+
+            if self._lowMemory:
+                painter.drawImage(target, img, source)
+            else:
+                tile = self._tile(level, tx, ty)
+                painter.drawPixmap(target, tile, tile.rect())
+
+        painter.restore()
 
     def paintEvent(self, evt):
-        super().paintEvent(evt)
+        start = time.perf_counter()
+        self._paint(evt)
+        self.frameTimer.add(time.perf_counter() - start)
 
-        if not self.pixmap():
+    def _paint(self, evt):
+        if not self.hasCanvas():
             return
 
         painter = QPainter(self)
+        # Clip to the exposed region, so overlay painters can skip everything outside of it.
+        # NOTE: not it's bounding rect, the crosshair's region spans the whole widget
+        region = evt.region()
+        painter.setClipRegion(region)
+        if self.hasImage():
+            self._paintTiles(painter, region.rects())
         painter.scale(*self.scale)
 
         self.paintStarted.emit(painter)
@@ -62,11 +261,11 @@ class ImageSelect(QLabel):
             sel = self.selection_start
 
             painter.setPen(self.selRectWhiteLinePen)
-            painter.drawLine(cur.x(), 0, cur.x(), self.pixmap().height())
-            painter.drawLine(0, cur.y(), self.pixmap().width(), cur.y())
+            painter.drawLine(cur.x(), 0, cur.x(), self._size.height())
+            painter.drawLine(0, cur.y(), self._size.width(), cur.y())
             painter.setPen(self.selRectBlackLinePen)
-            painter.drawLine(cur.x(), 0, cur.x(), self.pixmap().height())
-            painter.drawLine(0, cur.y(), self.pixmap().width(), cur.y())
+            painter.drawLine(cur.x(), 0, cur.x(), self._size.height())
+            painter.drawLine(0, cur.y(), self._size.width(), cur.y())
 
         if self.selection_start:
             # Paint selection rectangle
@@ -81,59 +280,134 @@ class ImageSelect(QLabel):
             # Paint selection dimensions rect and text
             painter.setPen(self.selLinePen)
 
-            text_x = cur.x()
-            text_y = cur.y()
-
-            if size_x < 0:
-                text_x = sel.x()
-            if size_y < 0:
-                text_y = sel.y()
-
-            text_y -= painter.pen().width()
-
-            dim_text = f"{abs(size_x)} x {abs(size_y)}"
-
-            text_fm = QFontMetrics(painter.font())
-            text_width = text_fm.width(dim_text)
-            text_height = text_fm.height()
+            dim_text, text_rect = self._dimensionLabel(cur, sel, painter.fontMetrics())
 
             painter.setBrush(self.textBgBrush)
-            painter.drawRect(text_x, text_y, text_width + 6, -text_height)
+            painter.drawRect(text_rect)
 
-            painter.drawText(text_x + 3, text_y - 3, dim_text)
+            painter.drawText(text_rect.x() + 3, text_rect.y() + text_rect.height() - 3, dim_text)
 
         if not self.selection_start:
             self.paintFinished.emit(painter)
 
         painter.end()
 
+    def _dimensionLabel(self, cur, sel, fm):
+        """ Returns the selection dimensions text and it's background rect in image coordinates. """
+        size_x = sel.x() - cur.x()
+        size_y = sel.y() - cur.y()
+
+        text_x = cur.x()
+        text_y = cur.y()
+
+        if size_x < 0:
+            text_x = sel.x()
+        if size_y < 0:
+            text_y = sel.y()
+
+        text_y -= self.selLinePen.width()
+
+        dim_text = f"{abs(size_x)} x {abs(size_y)}"
+        text_width = fm.width(dim_text)
+        text_height = fm.height()
+
+        return dim_text, QRect(text_x, text_y - text_height, text_width + 6, text_height)
+
+    def _computeOverlayRegion(self):
+        """
+        Widget area touched by the crosshair, selection rectangle and dimension label
+        for the current cursor and selection positions.
+        """
+        region = QRegion()
+        cur = self.cursor_pos
+        if not cur or not self.hasCanvas():
+            return region
+
+        sx, sy = self.scale
+        # Pens are scaled along with the painter, pad by the scaled pen width
+        pad = math.ceil(max(sx, sy) * self.selLinePen.width()) + 1
+        w = self.width()
+        h = self.height()
+
+        cx = int(cur.x() * sx)
+        cy = int(cur.y() * sy)
+        region = region.united(QRect(cx - pad, 0, 2 * pad + 1, h))
+        region = region.united(QRect(0, cy - pad, w, 2 * pad + 1))
+
+        sel = self.selection_start
+        if sel:
+            sel_rect = QRect(int(sel.x() * sx), int(sel.y() * sy),
+                             int((cur.x() - sel.x()) * sx), int((cur.y() - sel.y()) * sy)).normalized()
+            # Only the edges of the selection rectangle are drawn
+            left = sel_rect.left() - pad
+            top = sel_rect.top() - pad
+            edge = 2 * pad + 1
+            region = region.united(QRect(left, top, sel_rect.width() + edge, edge))
+            region = region.united(QRect(left, sel_rect.bottom() - pad, sel_rect.width() + edge, edge))
+            region = region.united(QRect(left, top, edge, sel_rect.height() + edge))
+            region = region.united(QRect(sel_rect.right() - pad, top, edge, sel_rect.height() + edge))
+
+            _, text_rect = self._dimensionLabel(cur, sel, self.fontMetrics())
+            label = QRect(int(text_rect.x() * sx), int(text_rect.y() * sy),
+                          math.ceil(text_rect.width() * sx), math.ceil(text_rect.height() * sy))
+            region = region.united(label.adjusted(-pad, -pad, pad, pad))
+
+        return region
+
+    def updateOverlay(self):
+        """ Repaint only the parts of the widget where the cursor overlays were and are now. """
+        region = self._computeOverlayRegion()
+        self.update(self._overlayRegion.united(region))
+        self._overlayRegion = region
+
+    def updateImageArea(self, x, y, w, h, margin=(0, 0)):
+        """ Repaint only the part of the widget showing the given image area, grown by margin. """
+        sx, sy = self.scale
+        mx, my = margin
+        # Pens are scaled along with the painter, pad by the scaled pen width
+        pad = math.ceil(max(sx, sy) * self.selLinePen.width()) + 1
+        x0 = math.floor((x - mx) * sx) - pad
+        y0 = math.floor((y - my) * sy) - pad
+        x1 = math.ceil((x + w + mx) * sx) + pad
+        y1 = math.ceil((y + h + my) * sy) + pad
+        self.update(QRect(x0, y0, x1 - x0, y1 - y0))
+
     def _transformPoint(self, p):
         return QPoint(p.x() / self.scale[0], p.y() / self.scale[1])
 
     def mousePressEvent(self, evt):
         if evt.buttons() == QtCore.Qt.LeftButton:
-            if not self.selection_start:
+            if not self.selection_start and evt.modifiers() & QtCore.Qt.ControlModifier:
+                self.selectionToggled.emit(self._transformPoint(evt.pos()))
+            elif not self.selection_start:
                 self.rectStarted.emit(evt.pos())
                 self.selection_start = self._transformPoint(evt.pos())
+                self.selecting = bool(evt.modifiers() & QtCore.Qt.ShiftModifier)
+                self.updateOverlay()
             else:
                 cur = self.selection_start
                 end = self._transformPoint(evt.pos())
                 rect = QRect(cur.x(), cur.y(),
                              end.x() - cur.x(), end.y() - cur.y())
-                self.rectFinished.emit(rect)
+                if self.selecting:
+                    self.selectionRectFinished.emit(rect)
+                else:
+                    self.rectFinished.emit(rect)
                 self.selection_start = None
-                self.update()
+                self.updateOverlay()
         elif evt.buttons() == QtCore.Qt.RightButton:
             if self.selection_start:
                 self.selection_start = None
+                self.updateOverlay()
             else:
                 self.contextMenu.emit(self._transformPoint(evt.pos()))
 
     def mouseMoveEvent(self, evt):
         self.cursor_pos = self._transformPoint(evt.pos())
-        self.update()
+        self.updateOverlay()
 
     def setScale(self, scale):
         self.scale = (scale, scale)
-        self.resize(scale * self.pixmap().size())
+        self.resize(self.sizeHint())
+        self._overlayRegion = self._computeOverlayRegion()
         self.update()
@@ -1,7 +1,8 @@
+import io
 import os
 import Myth.Util
 import functools
-import shutil
+import tinycss.decoding
 
 from PySide2.QtGui import *
 from PySide2.QtCore import *
@@ -13,16 +14,21 @@ from Myth.AboutWindow import AboutWindow
 from Myth.PackerWindow import PackerWindow
 
 from Myth.ImageSelect import ImageSelect
+from Myth.ImageLoader import ImageLoader
+from Myth.SpriteOverlay import SpriteOverlay
 from Myth.RCSSParser import RCSSParser
+from Myth.SpritesheetScanner import ScanError, locateSpritesheets, parseName
+from Myth.ParseCache import ParseCache
+from Myth.DocumentWatcher import DocumentWatcher
 from Myth.UiLoader import UiLoader
 from Myth.Commands import *
 
-from Myth.Models.Sprite import Sprite
 from Myth.Models.SpriteListModel import *
 from Myth.Models.SpritesheetListModel import *
 from Myth.Models.Spritesheet import *
 
 from MythPack.SpritePacker import SpritePacker
+from MythPack.InputCache import InputCache
 
 
 class MainWindow(QMainWindow):
@@ -34,16 +40,31 @@ class MainWindow(QMainWindow):
     undoStacks = {}
     curUndoStack = None
     recentFilesCount = 5
+    # Pixels the nudge actions move sprites with shift held
+    nudgeLargeStep = 10
     # HACK: refactor document into own class
     currentDocument = None
     currentDocumentDigest = None
     hasUnsavedChanges = False
+    currentImage = None
+    # (undo stack, filename) of a replaced image which is still loading, the command
+    # is only created once it has loaded
+    pendingImageReplace = None
+    # Reset the zoom once the image being loaded is displayed
+    zoomResetPending = False
+    # Set while the sprite list selection is being updated from the model
+    syncingSpriteSelection = False
 
     def __init__(self, parent=None):
         QMainWindow.__init__(self, parent)
         UiLoader.load_ui("ui/main.ui", self)
 
         self._setupImageSelect()
+        self._setupImageLoader()
+        self._setupParseCache()
+        self._setupPackerCache()
+        self._setupDocumentWatcher()
+        self._setupUndo()
         self._setupActions()
         self._setupMenus()
         self._setupRecentFiles()
@@ -86,14 +107,126 @@ class MainWindow(QMainWindow):
 
     def _setupImageSelect(self):
         self.imageSelect = ImageSelect()
+        self.spriteOverlay = SpriteOverlay()
         self.scrollArea.setWidget(self.imageSelect)
         self.scrollArea.setWidgetResizable(False)
 
         self.imageSelect.rectStarted.connect(self._cb_spriteStarted)
         self.imageSelect.rectFinished.connect(self._cb_spriteFinished)
+        self.imageSelect.selectionRectFinished.connect(self._cb_selectionRectFinished)
+        self.imageSelect.selectionToggled.connect(self._cb_selectionToggled)
         self.imageSelect.paintStarted.connect(self._cb_paintStarted)
         self.imageSelect.contextMenu.connect(self.tryOpenCtxMenu)
 
+        self.frameTimeLabel = QLabel()
+        self.frameTimeLabel.setVisible(False)
+        self.statusBar().addPermanentWidget(self.frameTimeLabel)
+        self.frameTimeTimer = QTimer(self)
+        self.frameTimeTimer.setInterval(500)
+        self.frameTimeTimer.timeout.connect(self._cb_updateFrameTime)
+
+    def _setupImageLoader(self):
+        settings = QSettings()
+        self.imageCacheBudget = int(settings.value("imageCacheBudgetMB", 512)) * 1024 * 1024
+        self.imageLoader = ImageLoader(self, self.imageCacheBudget)
+        self.imageLoader.progress.connect(self._cb_imageLoadProgress)
+        self.imageLoader.loaded.connect(self._cb_imageLoaded)
+        self.imageLoader.failed.connect(self._cb_imageLoadFailed)
+        self.imageLoader.canceled.connect(self._cb_imageLoadCanceled)
+
+        self.imageLoadProgress = QProgressBar()
+        self.imageLoadProgress.setMaximumWidth(200)
+        self.imageLoadProgress.setVisible(False)
+        self.statusBar().addPermanentWidget(self.imageLoadProgress)
+
+        self.imageLoadCancel = QToolButton()
+        self.imageLoadCancel.setIcon(QIcon.fromTheme("process-stop"))
+        self.imageLoadCancel.setToolTip("Cancel image loading")
+        self.imageLoadCancel.setVisible(False)
+        self.imageLoadCancel.clicked.connect(self.imageLoader.cancel)
+        self.statusBar().addPermanentWidget(self.imageLoadCancel)
+
+        lowMemory = settings.value("lowMemoryMode", False) in [True, "true"]
+        self.actionLowMemoryMode.setChecked(lowMemory)
+        self.setLowMemoryMode(lowMemory)
+
+    def _setupParseCache(self):
+        settings = QSettings()
+        self.parseCache = None
+        if settings.value("parseCacheEnabled", True) not in [True, "true"]:
+            self.actionClearParseCache.setEnabled(False)
+            return
+
+        cacheDir = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+        maxEntries = int(settings.value("parseCacheMaxEntries", 32))
+        maxBytes = int(settings.value("parseCacheMaxSizeMB", 64)) * 1024 * 1024
+        self.parseCache = ParseCache(os.path.join(cacheDir, "parsed"), maxEntries, maxBytes)
+
+    def _setupPackerCache(self):
+        settings = QSettings()
+        cacheDir = None
+        if settings.value("packerCacheEnabled", True) in [True, "true"]:
+            cacheDir = os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "packer")
+
+        imageBudget = int(settings.value("packerImageCacheMB", 256)) * 1024 * 1024
+        self.packerCache = InputCache(cacheDir, imageBudget=imageBudget)
+
+    def _setupDocumentWatcher(self):
+        self.documentWatcher = DocumentWatcher(self)
+        if QSettings().value("watchFilesForChanges", True) in [True, "true"]:
+            self.documentWatcher.stylesheetChanged.connect(self._cb_stylesheetChangedOnDisk)
+            self.documentWatcher.imageChanged.connect(self._cb_imageChangedOnDisk)
+
+    def _setupUndo(self):
+        settings = QSettings()
+        # NOTE: 0 means no limit, like QUndoStack.undoLimit
+        self.undoLimit = int(settings.value("undoLimit", 500))
+
+        self.undoMemoryLabel = QLabel()
+        self.statusBar().addPermanentWidget(self.undoMemoryLabel)
+
+    def _createUndoStack(self):
+        stack = QUndoStack(self)
+        # NOTE: the limit can only be set while the stack is empty
+        stack.setUndoLimit(self.undoLimit)
+        stack.indexChanged.connect(functools.partial(self._cb_undoStackChanged, stack))
+        return stack
+
+    def _dropUndoStack(self, name):
+        stack = self.undoStacks.pop(name, None)
+        if stack is None:
+            return
+        if stack is self.curUndoStack:
+            self.curUndoStack = None
+            self.updateUndoActions()
+        # NOTE: the stacks are children of the window, so they'd live as long as it otherwise
+        stack.deleteLater()
+
+    def _cb_undoStackChanged(self, stack, index):
+        self.setUnsavedChanges(True)
+        if stack is self.curUndoStack:
+            self.updateUndoActions()
+
+    def _undoMemory(self, stack):
+        return sum(stack.command(i).memoryEstimate() for i in range(stack.count()))
+
+    def updateUndoActions(self):
+        stack = self.curUndoStack
+        if stack is None:
+            self.actionUndo.setEnabled(False)
+            self.actionRedo.setEnabled(False)
+            self.undoMemoryLabel.clear()
+            return
+
+        self.actionUndo.setEnabled(stack.canUndo())
+        self.actionRedo.setEnabled(stack.canRedo())
+
+        kib = lambda n: f"{(n + 1023) // 1024} KiB"
+        self.undoMemoryLabel.setText(f"Undo: {stack.count()} steps, ~{kib(self._undoMemory(stack))}")
+        self.undoMemoryLabel.setToolTip("\n".join(
+            f"{name}: {s.count()} steps, ~{kib(self._undoMemory(s))}"
+            for name, s in sorted(self.undoStacks.items())))
+
     def _setupActions(self):
         self.actionSave.setEnabled(False)
         self.actionSaveAs.setEnabled(False)
@@ -103,12 +236,20 @@ class MainWindow(QMainWindow):
         self.actionSaveAs.triggered.connect(self._cb_actionSaveAs)
         self.actionReload.triggered.connect(self._cb_actionReload)
         self.actionPackImages.triggered.connect(self._cb_actionPackImages)
+        self.actionClearParseCache.triggered.connect(self._cb_actionClearParseCache)
         self.actionQuit.triggered.connect(self._cb_actionQuit)
 
         self.actionUndo.triggered.connect(lambda: self.curUndoStack.undo())
         self.actionRedo.triggered.connect(lambda: self.curUndoStack.redo())
 
         self.actionReplaceImage.triggered.connect(self._cb_actionReplaceImage)
+
+        for action, dx, dy in [(self.actionNudgeLeft, -1, 0), (self.actionNudgeRight, 1, 0),
+                               (self.actionNudgeUp, 0, -1), (self.actionNudgeDown, 0, 1)]:
+            # Same shortcut with shift held moves further
+            key = action.shortcut()
+            action.setShortcuts([key, QKeySequence("Shift+" + key.toString())])
+            action.triggered.connect(functools.partial(self._cb_actionNudge, dx, dy))
         self.actionSetResolution.triggered.connect(self._cb_actionSetResolution)
 
         self.actionZoomIn.triggered.connect(self._cb_actionZoomIn)
@@ -121,8 +262,10 @@ class MainWindow(QMainWindow):
         self.actionDrawSpriteFlipIndicators.triggered.connect(self.repaint)
 
         self.actionDrawSpritesDuringSketching.triggered.connect(self._cb_actionDrawSpritesDuringSketching)
-        self.actionFlipImageX.triggered.connect(self._cb_actionReload)
-        self.actionFlipImageY.triggered.connect(self._cb_actionReload)
+        self.actionFlipImageX.triggered.connect(self._cb_actionFlipImage)
+        self.actionFlipImageY.triggered.connect(self._cb_actionFlipImage)
+        self.actionLowMemoryMode.triggered.connect(self._cb_actionLowMemoryMode)
+        self.actionShowFrameTime.triggered.connect(self._cb_actionShowFrameTime)
 
         self.actionAbout.triggered.connect(self._cb_actionAbout)
 
@@ -137,13 +280,28 @@ class MainWindow(QMainWindow):
             if d.exec() == QDialog.Accepted:
                 self.createCommand(self.curUndoStack, CommandModifySprite, self, s, **d.newValues)
 
-        def cb_flipX():
-            s = self.spritesList.model().selected()
-            self.createCommand(self.curUndoStack, CommandFlipSprite, self, s, "x")
+        # NOTE: flip, move, resize and delete apply to all selected sprites, as a single command
+
+        def cb_flip(axis):
+            sprites = self.spritesList.model().selectedSprites()
+            if len(sprites) == 1:
+                self.createCommand(self.curUndoStack, CommandFlipSprite, self, sprites[0], axis)
+            else:
+                self.createCommand(self.curUndoStack, CommandFlipSprites, self, sprites, axis)
 
-        def cb_flipY():
+        def cb_move():
+            sprites = self.spritesList.model().selectedSprites()
+            offset = self._getIntPair("Move sprites", "Offset (x, y):", (0, 0))
+            if offset:
+                self.createCommand(self.curUndoStack, CommandTranslateSprites, self, sprites, *offset)
+
+        def cb_resize():
             s = self.spritesList.model().selected()
-            self.createCommand(self.curUndoStack, CommandFlipSprite, self, s, "y")
+            sprites = self.spritesList.model().selectedSprites()
+            size = self._getIntPair("Resize sprites", "Size (width, height):",
+                                    (s.width(), s.height()) if s else (0, 0))
+            if size:
+                self.createCommand(self.curUndoStack, CommandResizeSprites, self, sprites, *size)
 
         def cb_redraw():
             s = self.spritesList.model().selected()
@@ -151,21 +309,32 @@ class MainWindow(QMainWindow):
             self.statusBar().showMessage(f"Redrawing sprite {s.name()}...")
 
         def cb_delete():
-            s = self.spritesList.model().selected()
-            self.createCommand(self.curUndoStack, CommandDeleteSprite, self, s)
+            sprites = self.spritesList.model().selectedSprites()
+            if len(sprites) == 1:
+                self.createCommand(self.curUndoStack, CommandDeleteSprite, self, sprites[0])
+            else:
+                self.createCommand(self.curUndoStack, CommandDeleteSprites, self, sprites)
 
         editAction = QAction("Edit", self, triggered=cb_edit)
         editAction.setIcon(QIcon.fromTheme("document-properties"))
         self.ctxEditMenu.addAction(editAction)
 
-        flipXAction = QAction("Flip X", self, triggered=cb_flipX)
+        flipXAction = QAction("Flip X", self, triggered=lambda: cb_flip("x"))
         flipXAction.setIcon(QIcon.fromTheme("object-flip-horizontal"))
         self.ctxEditMenu.addAction(flipXAction)
 
-        flipYAction = QAction("Flip Y", self, triggered=cb_flipY)
+        flipYAction = QAction("Flip Y", self, triggered=lambda: cb_flip("y"))
         flipYAction.setIcon(QIcon.fromTheme("object-flip-vertical"))
         self.ctxEditMenu.addAction(flipYAction)
 
+        moveAction = QAction("Move...", self, triggered=cb_move)
+        moveAction.setIcon(QIcon.fromTheme("transform-move"))
+        self.ctxEditMenu.addAction(moveAction)
+
+        resizeAction = QAction("Resize...", self, triggered=cb_resize)
+        resizeAction.setIcon(QIcon.fromTheme("transform-scale"))
+        self.ctxEditMenu.addAction(resizeAction)
+
         redrawAction = QAction("Redraw", self, triggered=cb_redraw)
         redrawAction.setIcon(QIcon.fromTheme("list-add"))
         self.ctxEditMenu.addAction(redrawAction)
@@ -224,22 +393,21 @@ class MainWindow(QMainWindow):
         self.spritesList.setModel(mod)
         del prevmod
 
-        self.spritesList.selectionModel().currentChanged.connect(self._cb_spritesListSelectItem)
+        self.spritesList.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.spritesList.selectionModel().selectionChanged.connect(self._cb_spritesListSelectionChanged)
 
         if name not in self.undoStacks:
-            self.undoStacks[name] = QUndoStack(self)
+            self.undoStacks[name] = self._createUndoStack()
 
         self.curUndoStack = self.undoStacks[name]
-        self.curUndoStack.canUndoChanged.connect(lambda v: self.actionUndo.setEnabled(v))
-        self.curUndoStack.canRedoChanged.connect(lambda v: self.actionRedo.setEnabled(v))
-        self.curUndoStack.indexChanged.connect(lambda: self.setUnsavedChanges(True))
-        self.actionUndo.setEnabled(self.curUndoStack.canUndo())
-        self.actionRedo.setEnabled(self.curUndoStack.canRedo())
+        self.updateUndoActions()
 
         if loadImage:
             imgName = ssmod.getSheetImage(name)
-            self.loadImage(imagePath + imgName)
-            self._cb_actionZoomReset()
+            # NOTE: cached images are delivered right away, so this is set first
+            self.zoomResetPending = True
+            if not self.loadImage(imagePath + imgName):
+                self.zoomResetPending = False
 
         self.statusBar().showMessage(f"Selected spritesheet {name}")
 
@@ -247,10 +415,21 @@ class MainWindow(QMainWindow):
         if not self.promptForDiscardChanges():
             return
 
-        parser = RCSSParser()
-        css = parser.parse_stylesheet_file(filename)
+        with open(filename, "rb") as fd:
+            data = fd.read()
+        digest = Myth.Util.checksumData(data)
 
-        if parser.hadSpritesheetError:
+        cached = self.parseCache.get(digest) if self.parseCache else None
+        if cached:
+            css, hadSpritesheetError = cached
+        else:
+            parser = RCSSParser()
+            css = parser.parse_stylesheet_file(io.BytesIO(data))
+            hadSpritesheetError = parser.hadSpritesheetError
+            if self.parseCache:
+                self.parseCache.put(digest, css, hadSpritesheetError)
+
+        if hadSpritesheetError:
             print("CSS errors:", css.errors)
             QMessageBox.critical(self, self.windowTitle,
                                  f"Error loading file {filename}: {css.errors}")
@@ -279,20 +458,167 @@ class MainWindow(QMainWindow):
                 s = Spritesheet(basepath, linerange, ss.name, ss.declarations,
                                 ss.props["src"], ss.props.get("resolution"))
                 s.setBasepath(basepath)
+                s.setBlockDigest(ss.digest)
                 parsedSheets.append(s)
             except SpritesheetError as e:
                 QMessageBox.critical(self, self.windowTitle, f"Error parsing \"{ss.name}\": {e}")
                 return
 
         self.currentDocument = filename
-        self.currentDocumentDigest = Myth.Util.checksumFile(filename)
+        self.currentDocumentDigest = digest
+        self.documentWatcher.setStylesheet(filename, digest)
         self.setUnsavedChanges(False)
 
         self.updateTitle()
         self.loadParsedStylesheets(parsedSheets, True)
 
+    def reloadStylesheet(self, incremental=True):
+        """
+        Loads the current document again after it was changed outside of the program.
+
+        If incremental, only the spritesheet blocks which changed are parsed, and applied
+        to the existing sheets. Unchanged sheets keep their sprites, selection and undo
+        history. If the changes can't be applied that way then the whole document is
+        loaded again, keeping the selected spritesheet.
+        """
+        if not self.currentDocument:
+            return
+
+        mod = self.spritesheetsList.model()
+        if incremental and isinstance(mod, SpritesheetListModel) and self._reloadChangedSheets():
+            return
+
+        selected = mod.selected().name() if isinstance(mod, SpritesheetListModel) and mod.selected() else None
+
+        self.loadStylesheet(self.currentDocument)
+
+        mod = self.spritesheetsList.model()
+        for row, sheet in enumerate(mod.sheets()):
+            if row > 0 and sheet.name() == selected:
+                self.spritesheetsList.setCurrentIndex(mod.index(row))
+                break
+
+    def _diffStylesheet(self, data, sheets):
+        """
+        Matches the @spritesheet blocks of the new file contents to the sheets by name,
+        and parses the blocks whose digest differs from the one the sheet was loaded or
+        saved with. Returns a list of (sheet or None, block, rule or None) and the list of
+        sheets which no longer exist, or None if the file has to be loaded fully instead.
+        """
+        text, _ = tinycss.decoding.decode(data)
+        try:
+            blocks = locateSpritesheets(text)
+        except ScanError:
+            return None
+        if not blocks:
+            return None
+
+        byName = {}
+        for sheet in sheets:
+            byName.setdefault(sheet.name(), []).append(sheet)
+
+        parser = RCSSParser()
+        diff = []
+        for block in blocks:
+            try:
+                name = parseName(block.head)
+            except ScanError:
+                return None
+
+            candidates = byName.get(name)
+            sheet = candidates.pop(0) if candidates else None
+
+            if sheet is not None and sheet.blockDigest() == block.digest():
+                if block.endline is None:
+                    # NOTE: the line range of the sheet can't be updated without parsing
+                    # the block, the full load handles it
+                    return None
+                diff.append((sheet, block, None))
+                continue
+
+            rules, _ = parser.parse_block(block)
+            rules = [r for r in rules if r.at_keyword == "@spritesheet"]
+            if parser.hadSpritesheetError or len(rules) != 1 or rules[0].name != name:
+                # Let loadStylesheet report the errors
+                return None
+            diff.append((sheet, block, rules[0]))
+
+        removed = [s for l in byName.values() for s in l]
+        return diff, removed
+
+    def _reloadChangedSheets(self):
+        try:
+            with open(self.currentDocument, "rb") as fd:
+                data = fd.read()
+        except OSError:
+            return False
+
+        digest = Myth.Util.checksumData(data)
+        if digest == self.currentDocumentDigest:
+            return True
+
+        mod = self.spritesheetsList.model()
+        result = self._diffStylesheet(data, mod.sheets())
+        if result is None:
+            return False
+        diff, removed = result
+
+        selected = mod.selected()
+        selectedSprite = None
+        if selected is not None and self.spritesList.model().selected():
+            selectedSprite = self.spritesList.model().selected().name()
+        selectedImage = selected.sourceLongPath() if selected else None
+
+        basepath = os.path.dirname(self.currentDocument)
+        changed = []
+        for sheet, block, rule in diff:
+            if rule is None:
+                sheet.setLinerange((block.line - 1, block.endline - 1))
+                continue
+
+            linerange = (rule.line - 1, rule.endline - 1)
+
+            if sheet is None:
+                sheet = Spritesheet(basepath, linerange, rule.name, rule.declarations,
+                                    rule.props["src"], rule.props.get("resolution"))
+                mod.insertRow(sheet)
+            else:
+                sheet.setLinerange(linerange)
+                sheet.setSource(rule.props["src"])
+                sheet.setResolution(rule.props.get("resolution"))
+                sheet.replaceSprites(rule.declarations)
+                # The undo history refers to the sprites as they were before
+                if sheet.name() in self.undoStacks:
+                    self.undoStacks[sheet.name()].clear()
+
+            sheet.setBlockDigest(rule.digest)
+            changed.append(sheet)
+
+        for sheet in removed:
+            mod.removeRow(sheet)
+            self._dropUndoStack(sheet.name())
+
+        if selected in removed and mod.rowCount():
+            self.spritesheetsList.setCurrentIndex(mod.index(0))
+        elif selected in changed:
+            # Rebuild the sprite list of the displayed sheet
+            self.selectSpritesheet(selected.name(), selected.sourceLongPath() != selectedImage)
+            if selectedSprite:
+                self.spritesList.model().setSelectedByName(selectedSprite)
+            self.repaint()
+
+        self.currentDocumentDigest = digest
+        self.documentWatcher.setStylesheet(self.currentDocument, digest)
+        # NOTE: clearing the undo stacks marks the document as changed
+        self.setUnsavedChanges(False)
+
+        self.statusBar().showMessage(f"Reloaded {len(changed)} changed and removed {len(removed)} spritesheets")
+        return True
+
     def loadParsedStylesheets(self, sheets, loadImage=True):
         self.deleteAllSprites()
+        for name in list(self.undoStacks):
+            self._dropUndoStack(name)
         self.undoStacks = {}
 
         mod = SpritesheetListModel(sheets=sheets)
@@ -308,18 +634,30 @@ class MainWindow(QMainWindow):
         self.spritesheetsList.selectionModel().currentChanged.connect(lambda cur,prev: self.selectSpritesheet(cur.data()))
         self.statusBar().showMessage(f"Successfully loaded {len(sheets)} spritesheets")
 
-    def saveStylesheetsNewFile(self, outputFilename):
-        sheetData = self.serializeStylesheets()
-        sheetDataLines = sheetData.count("\n") - 1
-
-        with open(outputFilename, "w") as fd:
-            fd.write(sheetData)
+    def _atomicFileWriter(self, filename):
+        settings = QSettings()
+        fsync = settings.value("saveFsync", True) in [True, "true"]
+        backup = settings.value("saveKeepBackup", False) in [True, "true"]
+        return Myth.Util.AtomicFileWriter(filename, fsync, backup)
 
-        for sheet in self.spritesheetsList.model().sheets():
-            sheet.setLinerange((0, sheetDataLines))
+    def saveStylesheetsNewFile(self, outputFilename):
+        sheets = self.spritesheetsList.model().sheets()
+        written = []
+        writer = self._atomicFileWriter(outputFilename)
+        with writer as fd:
+            line = 0
+            for sheet in sheets:
+                lines, digest = sheet.writeHashed(fd)
+                written.append(((line, line + lines - 1), digest))
+                line += lines
+
+        for sheet, (range, digest) in zip(sheets, written):
+            sheet.setLinerange(range)
+            sheet.setBlockDigest(digest)
 
         self.setUnsavedChanges(False)
-        self.currentDocumentDigest = Myth.Util.checksumFile(outputFilename)
+        self.currentDocumentDigest = writer.digest()
+        self.documentWatcher.setStylesheet(outputFilename, self.currentDocumentDigest)
         self.statusBar().showMessage(f"Successfully saved stylesheet {outputFilename}")
 
         return outputFilename
@@ -338,8 +676,7 @@ Do you wish to continue?
         if warn != QMessageBox.StandardButton.Yes:
             return
 
-        digest = Myth.Util.checksumFile(self.currentDocument)
-        if digest != self.currentDocumentDigest:
+        if self.documentWatcher.isStylesheetModified():
             msg = """The file has been changed outside of this tool!
 This will most likely cause file corruption if the number of lines has changed.
 You really shouldn't continue..
@@ -351,55 +688,45 @@ Do you wish to continue?"""
         if outputFilename is None:
             outputFilename = self.currentDocument
 
-        # If we're overwriting then create a backup to read from
-        backupFilename = None
-        if outputFilename == self.currentDocument:
-            backupFilename = self.currentDocument + ".bak"
-            shutil.copyfile(self.currentDocument, backupFilename)
-        else:
-            backupFilename = self.currentDocument
-
-        sheetData = self.serializeStylesheets()
-        sheetDataLines = sheetData.count("\n") - 1
+        # NOTE: the new file is written next to the old one and only replaces it once complete,
+        # so the old one can be read while writing even when overwriting it.
+        sheets = self.spritesheetsList.model().sheets()
+        writer = self._atomicFileWriter(outputFilename)
+        with writer as fd, open(self.currentDocument, "r") as fs:
+            written = spliceSpritesheets(fs, fd, sheets)
 
-        ranges = []
-        for sheet in self.spritesheetsList.model().sheets():
-            range = sheet.linerange()
-            if range:
-                ranges.append(range)
-
-        dumpRange = None
-        with open(outputFilename, "w") as fd, open(backupFilename, "r") as fs:
-            for i,l in enumerate(fs):
-                inrange = list(filter(lambda range: range[0] <= i and range[1] >= i, ranges))
-
-                if len(inrange) > 0:
-                    if not dumpRange:
-                        fd.write(sheetData)
-                        dumpRange = (i, i+sheetDataLines)
-                    continue
-
-                fd.write(l)
-
-        # Rewrite all ranges, since we dumped them all in the same range
-        for sheet in self.spritesheetsList.model().sheets():
-            sheet.setLinerange(dumpRange)
+        for sheet, (range, digest) in zip(sheets, written):
+            sheet.setLinerange(range)
+            sheet.setBlockDigest(digest)
 
         self.setUnsavedChanges(False)
-        self.currentDocumentDigest = Myth.Util.checksumFile(outputFilename)
+        self.currentDocumentDigest = writer.digest()
+        self.documentWatcher.setStylesheet(outputFilename, self.currentDocumentDigest)
         self.statusBar().showMessage(f"Successfully saved stylesheet {outputFilename}")
 
         return outputFilename
 
-    def serializeStylesheets(self):
-        ret = ""
+    def writeStylesheets(self, fd):
+        """ Writes all spritesheets into a text file object, returns the number of lines written. """
+        lines = 0
         for ss in self.spritesheetsList.model().sheets():
-            ret += ss.serialize()
-        return ret
+            lines += ss.write(fd)
+        return lines
+
+    def serializeStylesheets(self):
+        buf = io.StringIO()
+        self.writeStylesheets(buf)
+        return buf.getvalue()
 
     def repaint(self):
         self.imageSelect.update()
 
+    def repaintSpriteArea(self, *rects):
+        """ Repaints only the canvas around the given (x, y, w, h) sprite rectangles. """
+        margin = self.spriteOverlay.margin()
+        for x, y, w, h in rects:
+            self.imageSelect.updateImageArea(x, y, w, h, margin)
+
     def openCtxSpriteSelectMenu(self, pos, sprites):
         def cb_select(act):
             self.spritesList.model().setSelectedByName(act.text())
@@ -433,6 +760,12 @@ Do you wish to continue?"""
         if len(hit) == 0:
             return
 
+        # Keep a multiple selection when clicking on one of it's sprites
+        mod = self.spritesList.model()
+        if len(mod.selection()) > 1 and any(mod.isSelected(spr) for spr in hit):
+            self.ctxEditMenu.popup(pos)
+            return
+
         if len(hit) > 1:
             self.spritesList.model().clearSelection()
             self.repaint()
@@ -441,29 +774,86 @@ Do you wish to continue?"""
 
         selHit = hit[0]
         self.spritesList.model().setSelected(selHit)
+        self.syncSpritesListSelection()
         self.repaint()
         self.ctxEditMenu.popup(pos)
 
     def loadImage(self, filename):
+        """
+        Starts loading the image on a worker thread, the image is displayed once it has
+        been decoded. Returns False if the file can't be read as an image at all.
+        """
+        # NOTE: only reads the image header
         reader = QImageReader(filename)
-        qimg = reader.read()
-
-        if reader.error():
-            QMessageBox.warning(self, self.windowTitle, f"Failed to load {filename}: {reader.error()}.")
+        if not reader.canRead():
+            QMessageBox.warning(self, self.windowTitle, f"Failed to load {filename}: {reader.errorString()}.")
             return False
 
-        self.setImage(qimg)
-        self.statusBar().showMessage(f"Successfully loaded image {filename}")
+        # Loading another image cancels the one which was replacing the sheet's image
+        if self.pendingImageReplace and self.pendingImageReplace[1] != filename:
+            self.pendingImageReplace = None
+
+        # Keep displaying the old pixels when reloading the same image, otherwise show an
+        # empty canvas of the right size, so sprites can be worked on while it loads.
+        if filename != self.currentImage:
+            self.imageSelect.setPlaceholder(reader.size())
+            self.currentImage = None
+
+        self.imageLoadProgress.setRange(0, 100)
+        self.imageLoadProgress.setValue(0)
+        self.imageLoadProgress.setVisible(True)
+        self.imageLoadCancel.setVisible(True)
+        self.statusBar().showMessage(f"Loading image {filename}...")
+
+        # NOTE: cached images are delivered right away, which hides the progress again
+        self.imageLoader.load(filename)
         return True
 
+    def _hideImageLoadProgress(self):
+        self.imageLoadProgress.setVisible(False)
+        self.imageLoadCancel.setVisible(False)
+
+    def _cb_imageLoadProgress(self, filename, percent):
+        if percent < 0:
+            # Decoding doesn't report progress, show a busy indicator
+            self.imageLoadProgress.setRange(0, 0)
+        else:
+            self.imageLoadProgress.setValue(percent)
+
+    def _cb_imageLoaded(self, filename, image):
+        self._hideImageLoadProgress()
+        self.currentImage = filename
+        self.documentWatcher.setImage(filename)
+        self.setImage(image)
+        if self.zoomResetPending:
+            self.zoomResetPending = False
+            self._cb_actionZoomReset()
+        self.statusBar().showMessage(f"Successfully loaded image {filename}")
+
+        if self.pendingImageReplace and self.pendingImageReplace[1] == filename:
+            stack, _ = self.pendingImageReplace
+            self.pendingImageReplace = None
+            self.createCommand(stack, CommandSetImage, self, filename)
+
+    def _cb_imageLoadFailed(self, filename, error):
+        self._hideImageLoadProgress()
+        self.zoomResetPending = False
+        self.pendingImageReplace = None
+        QMessageBox.warning(self, self.windowTitle, f"Failed to load {filename}: {error}.")
+
+    def _cb_imageLoadCanceled(self, filename):
+        self._hideImageLoadProgress()
+        self.zoomResetPending = False
+        self.pendingImageReplace = None
+        self.statusBar().showMessage(f"Canceled loading image {filename}")
+
     def setImage(self, image):
-        pixmap = QPixmap.fromImage(image)
         flipX = self.actionFlipImageX.isChecked()
         flipY = self.actionFlipImageY.isChecked()
 
-        self.imageSelect.setPixmap(pixmap, flipX, flipY)
-        self.scale = 1.0
-        self.imageSelect.adjustSize()
+        self.imageSelect.setImage(image, flipX, flipY)
+        # NOTE: keep the zoom level, it may have been changed while the image was loading
+        self.imageSelect.setScale(self.scale)
 
         self.actionSave.setEnabled(True)
         self.actionSaveAs.setEnabled(True)
@@ -471,6 +861,12 @@ Do you wish to continue?"""
         self.actionSetResolution.setEnabled(True)
         self.actionReload.setEnabled(True)
 
+    def setLowMemoryMode(self, enabled):
+        self.imageSelect.setLowMemory(enabled)
+        # NOTE: the displayed image shares it's pixels with the cache, so with a zero
+        # budget only the displayed image is kept around.
+        self.imageLoader.cache().setBudget(0 if enabled else self.imageCacheBudget)
+
     def scaleImage(self, factor):
         self.scale *= factor
         self.imageSelect.setScale(self.scale)
@@ -485,6 +881,7 @@ Do you wish to continue?"""
         try:
             cmd = type(*args, **kwargs)
             stack.push(cmd)
+            self.updateUndoActions()
             self.setUnsavedChanges(True)
             return True
         except CommandError as e:
@@ -504,42 +901,15 @@ Do you wish to continue?"""
         if not self.actionDrawSpriteOutlines.isChecked():
             return
 
-        for spr in self.spritesList.model().sprites():
-            x = spr.x()
-            y = spr.y()
-            w = spr.width()
-            h = spr.height()
-
-            if spr == self.spritesList.model().selected():
-                painter.setPen(QPen(Qt.red, 3))
-            else:
-                painter.setPen(QPen(Qt.black))
-
-            painter.drawRect(spr)
-
-            if self.actionDrawSpriteDiagonals.isChecked():
-                painter.drawLine(x, y, x + w, y + h)
-                painter.drawLine(x + w, y, x, y + h)
-
-            text_fm = QFontMetrics(painter.font())
-            if self.actionDrawSpriteNames.isChecked():
-                text_width = text_fm.width(spr.name())
-                painter.drawText(x + w/2 - text_width/2, y + h/2, spr.name())
-
-            if self.actionDrawSpriteFlipIndicators.isChecked():
-                drewX = False
-                th = text_fm.height()
-                if spr.isFlippedX():
-                    painter.drawText(x, y + th, "X flipped")
-                    drewX = True
-                if spr.isFlippedY():
-                    offset = th
-                    if drewX:
-                        offset *= 2
-                    painter.drawText(x, y + offset, "Y flipped")
+        self.spriteOverlay.paint(painter, self.spritesList.model(),
+                                 names=self.actionDrawSpriteNames.isChecked(),
+                                 diagonals=self.actionDrawSpriteDiagonals.isChecked(),
+                                 flipIndicators=self.actionDrawSpriteFlipIndicators.isChecked())
 
     def _cb_spriteStarted(self):
         self.spritesList.model().clearSelection()
+        self.syncSpritesListSelection()
+        self.repaint()
 
     def _cb_spriteFinished(self, r):
         if self.redrawingSprite:
@@ -556,7 +926,10 @@ Do you wish to continue?"""
                 self.statusBar().showMessage("Failed to get name for sprite")
                 return
 
-            spr = Sprite(name, r.x(), r.y(), r.width(), r.height())
+            # NOTE: allocated in the sheet's store but not added to it's order, the
+            # command adds it
+            store = self.spritesList.model().sprites()
+            spr = store.view(store.allocate(name, r.x(), r.y(), r.width(), r.height()))
             self.createCommand(self.curUndoStack, CommandCreateSprite, self, spr)
 
     def _cb_actionQuit(self):
@@ -564,16 +937,78 @@ Do you wish to continue?"""
             return
         self.close()
 
+    def _cb_actionClearParseCache(self):
+        if self.parseCache:
+            self.parseCache.clear()
+            self.statusBar().showMessage("Cleared the parse cache")
+
+    def _cb_stylesheetChangedOnDisk(self, filename):
+        if filename != self.currentDocument:
+            return
+
+        if self.hasUnsavedChanges:
+            msg = f"""{os.path.basename(filename)} has been changed outside of this tool.
+Do you wish to reload it and discard your changes?"""
+            q = QMessageBox.question(self, self.windowTitle, msg)
+            if q != QMessageBox.StandardButton.Yes:
+                return
+            self.setUnsavedChanges(False)
+
+            # NOTE: the unsaved changes may be in any sheet, so they all have to be loaded again
+            self.reloadStylesheet(incremental=False)
+            self.statusBar().showMessage(f"Reloaded {filename}, it was changed outside of this tool")
+            return
+
+        self.reloadStylesheet()
+
+    def _cb_imageChangedOnDisk(self, filename):
+        # NOTE: the image cache is keyed by mtime, so this decodes the new version
+        if filename == self.currentImage:
+            self.loadImage(filename)
+
     def _cb_actionReload(self):
         # NOTE: this isn't a CommandReload because we can't undo a reload anyways :-)
         if not self.loadImage(self.spritesList.model().sheet().sourceLongPath()):
             self.statusBar().showMessage("Image reload failed!")
 
+    def _cb_actionFlipImage(self):
+        self.imageSelect.setFlip(self.actionFlipImageX.isChecked(),
+                                 self.actionFlipImageY.isChecked())
+
+    def _cb_actionLowMemoryMode(self):
+        enabled = self.actionLowMemoryMode.isChecked()
+        QSettings().setValue("lowMemoryMode", enabled)
+        self.setLowMemoryMode(enabled)
+
     def _cb_actionReplaceImage(self):
         fmts = Myth.Util.supportedImageReadFormats(True)
         filename,_ = QFileDialog.getOpenFileName(self, "Open image", QDir.currentPath(), fmts)
-        if filename:
-            self.createCommand(self.curUndoStack, CommandSetImage, self, filename)
+        if not filename:
+            return
+
+        # NOTE: the sheet's image only changes once the new one has loaded, which may
+        # happen right away for cached images
+        self.pendingImageReplace = (self.curUndoStack, filename)
+        if not self.loadImage(filename):
+            self.pendingImageReplace = None
+
+    def _cb_actionNudge(self, dx, dy, checked=False):
+        mod = self.spritesList.model()
+        if not isinstance(mod, SpriteListModel):
+            return
+
+        if QApplication.keyboardModifiers() & Qt.ShiftModifier:
+            dx *= self.nudgeLargeStep
+            dy *= self.nudgeLargeStep
+
+        # NOTE: repeated nudges merge into a single undo entry
+        sprites = mod.selectedSprites()
+        if len(sprites) == 1:
+            s = sprites[0]
+            self.createCommand(self.curUndoStack, CommandModifySprite, self, s,
+                               s.x() + dx, s.y() + dy, s.width(), s.height())
+        elif sprites:
+            self.createCommand(self.curUndoStack, CommandTranslateSprites, self, sprites, dx, dy)
 
     def _cb_actionSetResolution(self):
         sheet = self.spritesList.model().sheet()
@@ -582,9 +1017,79 @@ Do you wish to continue?"""
         if res and ok:
             self.createCommand(self.curUndoStack, CommandSetResolution, self, res)
 
-    def _cb_spritesListSelectItem(self, it):
-        self.spritesList.model().setSelectedByName(it.data())
+    def _cb_spritesListSelectionChanged(self, selected, deselected):
+        if self.syncingSpriteSelection:
+            return
+
+        mod = self.spritesList.model()
+        store = mod.sprites()
+        slots = store.slots()
+        selModel = self.spritesList.selectionModel()
+        sprites = [store.view(slots[idx.row()]) for idx in selModel.selectedRows()]
+
+        cur = self.spritesList.currentIndex()
+        current = store.view(slots[cur.row()]) if cur.isValid() and selModel.isSelected(cur) else None
+        mod.setSelection(sprites, current)
+        self.repaint()
+
+    def syncSpritesListSelection(self):
+        """ Selects the rows of the sprites selected in the model, one range per contiguous run. """
+        mod = self.spritesList.model()
+        sel = mod.selection()
+        itemSel = QItemSelection()
+        start = prev = None
+        for row, slot in enumerate(mod.sprites().slots()):
+            if slot not in sel:
+                continue
+            if start is not None and row == prev + 1:
+                prev = row
+                continue
+            if start is not None:
+                itemSel.select(mod.index(start), mod.index(prev))
+            start = prev = row
+        if start is not None:
+            itemSel.select(mod.index(start), mod.index(prev))
+
+        self.syncingSpriteSelection = True
+        selModel = self.spritesList.selectionModel()
+        selModel.select(itemSel, QItemSelectionModel.ClearAndSelect)
+        if mod.selected() is not None:
+            idx = mod.index(mod.sprites().row(mod.selected().slot()))
+            selModel.setCurrentIndex(idx, QItemSelectionModel.NoUpdate)
+            self.spritesList.scrollTo(idx)
+        self.syncingSpriteSelection = False
+
+    def _cb_selectionRectFinished(self, r):
+        r = r.normalized()
+        mod = self.spritesList.model()
+        sprites = [spr for spr in mod.spritesInRect(r) if r.contains(spr.rect())]
+        mod.setSelection(sprites)
+        self.syncSpritesListSelection()
         self.repaint()
+        self.statusBar().showMessage(f"Selected {len(sprites)} sprites")
+
+    def _cb_selectionToggled(self, pos):
+        mod = self.spritesList.model()
+        hit = mod.hitTest(pos)
+        if not hit:
+            return
+        mod.toggleSelected(hit[0])
+        self.syncSpritesListSelection()
+        self.repaint()
+        self.statusBar().showMessage(f"{len(mod.selection())} sprites selected")
+
+    def _getIntPair(self, title, label, default):
+        """ Asks for two whole numbers, returns them as a tuple or None. """
+        text, ok = QInputDialog().getText(self, title, label, QLineEdit.Normal,
+                                          f"{default[0]}, {default[1]}")
+        if not ok:
+            return None
+        try:
+            a, b = (int(v) for v in text.replace(",", " ").split())
+        except ValueError:
+            QMessageBox.warning(self, self.windowTitle, f"Expected two whole numbers, got: {text}")
+            return None
+        return a, b
 
     def _cb_actionOpen(self):
         fmts = "RCSS stylesheet (*.rcss);;All files (*)"
@@ -624,16 +1129,21 @@ Do you wish to continue?"""
         self.updateTitle()
 
     def _cb_actionPackImages(self):
-        d = PackerWindow()
+        d = PackerWindow(self.packerCache)
         if d.exec() == QDialog.Accepted:
+            sheets = d.generatedSheets
             mod = self.spritesheetsList.model()
             if isinstance(mod, SpritesheetListModel):
-                d.generatedSheet.setName(f"generated-{mod.rowCount()+1}")
-                mod.insertRow(d.generatedSheet)
+                for i, sheet in enumerate(sheets):
+                    sheet.setName(f"generated-{mod.rowCount()+1+i}")
+                mod.insertSheets(sheets)
             else:
-                self.loadParsedStylesheets([ d.generatedSheet ])
+                self.loadParsedStylesheets(sheets)
             self.setUnsavedChanges(True)
-            self.statusBar().showMessage("Successfully packed a spritesheet")
+            if len(sheets) == 1:
+                self.statusBar().showMessage("Successfully packed a spritesheet")
+            else:
+                self.statusBar().showMessage(f"Successfully packed {len(sheets)} spritesheets")
 
     def _cb_actionZoomIn(self):
         self.scaleImage(1.25)
@@ -647,6 +1157,22 @@ Do you wish to continue?"""
         self.imageSelect.setScale(1.0)
         self.scaleImage(1.0)
 
+    def _cb_actionShowFrameTime(self):
+        show = self.actionShowFrameTime.isChecked()
+        self.frameTimeLabel.setVisible(show)
+        if show:
+            self.imageSelect.frameTimer.reset()
+            self._cb_updateFrameTime()
+            self.frameTimeTimer.start()
+        else:
+            self.frameTimeTimer.stop()
+
+    def _cb_updateFrameTime(self):
+        ft = self.imageSelect.frameTimer
+        self.frameTimeLabel.setText(f"Frame: {ft.last()*1000:.2f} ms "
+                                    f"(avg {ft.average()*1000:.2f} ms, "
+                                    f"worst {ft.worst()*1000:.2f} ms)")
+
     def _cb_actionAbout(self):
         AboutWindow().exec()
 
@@ -0,0 +1,201 @@
+from collections import deque
+
+
+class SpatialIndex:
+    """
+    Uniform grid over axis-aligned rectangles.
+
+    Every item is filed under each grid cell its rectangle touches, so point and
+    rectangle queries only have to look at the items sharing a cell with the query
+    instead of all of them. Items can be anything hashable, the SpriteListModel
+    indexes the slots of it's SpriteStore.
+
+    Very large rectangles (covering more than maxCellsPerItem cells) are kept in a
+    separate list and tested linearly, so a single full-sheet sprite doesn't have
+    to be filed under thousands of cells.
+
+    The rectangles touched by the last maxDirty geometry changes are remembered,
+    so anything caching a rendering of the items can refresh just those areas.
+    """
+
+    maxCellsPerItem = 1024
+    maxDirty = 256
+
+    def __init__(self, cellSize=64):
+        self._cellSize = cellSize
+        self._cells = {}
+        self._oversized = {}
+        # item -> [seq, x, y, w, h, cells]
+        self._entries = {}
+        self._seq = 0
+        self._revision = 0
+        # (revision, x, y, w, h) of the latest geometry changes
+        self._dirty = deque(maxlen=self.maxDirty)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def cellSize(self):
+        return self._cellSize
+
+    def revision(self):
+        """ Counter which is bumped on every change to the indexed items. """
+        return self._revision
+
+    def touch(self):
+        """ Marks everything as changed, for changes without a known area. """
+        self._revision += 1
+        self._dirty.clear()
+
+    def _markDirty(self, x, y, w, h):
+        self._revision += 1
+        self._dirty.append((self._revision, x, y, w, h))
+
+    def dirtySince(self, revision):
+        """
+        Returns the (x, y, w, h) rectangles changed after the given revision, or None
+        if they aren't known anymore and everything has to be considered changed.
+        """
+        if revision == self._revision:
+            return []
+        dirty = self._dirty
+        if not dirty or dirty[0][0] > revision + 1:
+            return None
+        return [d[1:] for d in dirty if d[0] > revision]
+
+    def clear(self):
+        self._cells = {}
+        self._oversized = {}
+        self._entries = {}
+        self.touch()
+
+    def rebuild(self, items, cellSize=None):
+        """
+        Re-create the index from (item, x, y, w, h) tuples.
+        If cellSize is not given then it is derived from the average item size.
+        """
+        items = list(items)
+        self.clear()
+
+        if cellSize is None and len(items):
+            avg = sum(max(it[3], it[4]) for it in items) / len(items)
+            cellSize = min(max(int(avg * 2), 16), 1024)
+        if cellSize:
+            self._cellSize = cellSize
+
+        for it in items:
+            self.insert(*it)
+
+    def _cellRange(self, x, y, w, h):
+        cs = self._cellSize
+        return (x // cs, y // cs, (x + max(w, 0)) // cs, (y + max(h, 0)) // cs)
+
+    def _file(self, key, cells):
+        cx0, cy0, cx1, cy1 = cells
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > self.maxCellsPerItem:
+            self._oversized[key] = True
+            return
+
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is None:
+                    self._cells[(cx, cy)] = cell = set()
+                cell.add(key)
+
+    def _unfile(self, key, cells):
+        if self._oversized.pop(key, None):
+            return
+
+        cx0, cy0, cx1, cy1 = cells
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is None:
+                    continue
+                cell.discard(key)
+                if not cell:
+                    del self._cells[(cx, cy)]
+
+    def insert(self, item, x, y, w, h):
+        if item in self._entries:
+            return self.update(item, x, y, w, h)
+
+        cells = self._cellRange(x, y, w, h)
+        self._entries[item] = [self._seq, x, y, w, h, cells]
+        self._seq += 1
+        self._file(item, cells)
+        self._markDirty(x, y, w, h)
+
+    def remove(self, item):
+        entry = self._entries.pop(item, None)
+        if entry is None:
+            return False
+
+        self._unfile(item, entry[5])
+        self._markDirty(*entry[1:5])
+        return True
+
+    def update(self, item, x, y, w, h):
+        entry = self._entries.get(item)
+        if entry is None:
+            return False
+
+        cells = self._cellRange(x, y, w, h)
+        if cells != entry[5]:
+            self._unfile(item, entry[5])
+            self._file(item, cells)
+
+        self._markDirty(*entry[1:5])
+        entry[1:] = [x, y, w, h, cells]
+        self._markDirty(x, y, w, h)
+        return True
+
+    def _candidates(self, cells):
+        keys = set(self._oversized)
+        cx0, cy0, cx1, cy1 = cells
+        # If the query covers more cells than there are occupied cells then walk
+        # the occupied ones instead.
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            for (cx, cy), cell in self._cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    keys.update(cell)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    cell = self._cells.get((cx, cy))
+                    if cell:
+                        keys.update(cell)
+        return keys
+
+    def _sorted(self, hit):
+        entries = self._entries
+        hit.sort(key=lambda item: entries[item][0])
+        return hit
+
+    def queryPoint(self, px, py):
+        """
+        Returns all items whose rectangle contains the point (edges inclusive),
+        in insertion order.
+        """
+        hit = []
+        for key in self._candidates(self._cellRange(px, py, 0, 0)):
+            e = self._entries[key]
+            if e[1] <= px <= e[1] + e[3] and e[2] <= py <= e[2] + e[4]:
+                hit.append(key)
+        return self._sorted(hit)
+
+    def queryRect(self, x, y, w, h):
+        """
+        Returns all items whose rectangle overlaps the given rectangle (edges inclusive),
+        in insertion order.
+        """
+        hit = []
+        for key in self._candidates(self._cellRange(x, y, w, h)):
+            e = self._entries[key]
+            if e[1] <= x + w and x <= e[1] + e[3] and e[2] <= y + h and y <= e[2] + e[4]:
+                hit.append(key)
+        return self._sorted(hit)
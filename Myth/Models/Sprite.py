@@ -1,74 +1,109 @@
 from PySide2.QtCore import QRect
 
-class Sprite(QRect):
-    flippedW = False
-    flippedH = False
+class Sprite:
+    """
+    View of a sprite in a SpriteStore. Views are cheap and created on demand, two
+    views of the same slot compare (and hash) equal.
+
+    A sprite created from a name and geometry lives in a store shared by all such
+    sprites, and is moved into a sheet's store when it's inserted into the sheet's
+    SpriteListModel. Sprites which are meant for a sheet are better allocated in
+    it's store right away.
+    """
+    __slots__ = ("_store", "_slot")
+    # NOTE: set by SpriteStore, which needs this class
+    _scratch = None
 
     def __init__(self, name, x, y, w, h):
-        super().__init__()
+        self._store = Sprite._scratch
+        self._slot = self._store.allocate(name, x, y, w, h)
 
-        self._name = name
-        self.setSize(x, y, w, h)
+    @classmethod
+    def _view(cls, store, slot):
+        spr = cls.__new__(cls)
+        spr._store = store
+        spr._slot = slot
+        return spr
+
+    def _rebind(self, store, slot):
+        # NOTE: changes the hash, so the sprite must not be in a set or dict key meanwhile
+        self._store = store
+        self._slot = slot
+
+    def __eq__(self, other):
+        if not isinstance(other, Sprite):
+            return NotImplemented
+        return self._store is other._store and self._slot == other._slot
+
+    def __hash__(self):
+        return hash((id(self._store), self._slot))
+
+    def store(self):
+        return self._store
+
+    def slot(self):
+        return self._slot
 
     def name(self):
-        return self._name
+        return self._store.name(self._slot)
 
     def setName(self, name):
-        self._name = name
+        self._store.setName(self._slot, name)
 
     def isFlippedX(self):
-        return self.flippedW
+        return self._store.isFlippedX(self._slot)
 
     def isFlippedY(self):
-        return self.flippedH
+        return self._store.isFlippedY(self._slot)
 
     def flipX(self):
-        self.flippedW = not self.flippedW
+        self._store.flipX(self._slot)
 
     def flipY(self):
-        self.flippedH = not self.flippedH
+        self._store.flipY(self._slot)
+
+    def x(self):
+        return self._store.x(self._slot)
+
+    def y(self):
+        return self._store.y(self._slot)
+
+    def width(self):
+        return self._store.width(self._slot)
+
+    def height(self):
+        return self._store.height(self._slot)
+
+    def rect(self):
+        return QRect(*self._store.geometry(self._slot))
 
     def setSize(self, x, y, w, h):
-        # If the sprite would have negative w/h then
-        # shift it into the positive for AABB testing
-        if w < 0:
-            x += w
-            w = abs(w)
-            self.flippedW = True
-        if h < 0:
-            y += h
-            h = abs(h)
-            self.flippedH = True
-        self.setX(x)
-        self.setY(y)
-        self.setWidth(w)
-        self.setHeight(h)
+        self._store.setGeometry(self._slot, x, y, w, h)
 
-    def aabbTest(self, p):
-        rx = self.x()
-        ry = self.y()
-        rw = self.width()
-        rh = self.height()
-        px = p.x()
-        py = p.y()
+    # NOTE: these behave like the QRect setters, moving one edge and keeping the other
+
+    def setX(self, x):
+        ox, y, w, h = self._store.geometry(self._slot)
+        self.setSize(x, y, ox + w - x, h)
 
-        if px > rx and py > ry and px < (rx + rw) and py < (ry + rh):
-            return True
-        return False
+    def setY(self, y):
+        x, oy, w, h = self._store.geometry(self._slot)
+        self.setSize(x, y, w, oy + h - y)
+
+    def setWidth(self, w):
+        x, y, _, h = self._store.geometry(self._slot)
+        self.setSize(x, y, w, h)
+
+    def setHeight(self, h):
+        x, y, w, _ = self._store.geometry(self._slot)
+        self.setSize(x, y, w, h)
+
+    def aabbTest(self, p):
+        return self._store.aabbTest(self._slot, p.x(), p.y())
 
     def toRCSS(self):
-        x = self.x()
-        y = self.y()
-        w = self.width()
-        h = self.height()
-
-        # NOTE: if we shifted the image during image loading then shift it back, as
-        # otherwise mirrored images will be wrong in RmlUI.
-        if self.flippedW:
-            w = -w
-            x -= w
-        if self.flippedH:
-            h = -h
-            y -= h
-
-        return f"{self.name()}: {x}px {y}px {w}px {h}px;"
+        return self._store.toRCSS(self._slot)
+
+
+# NOTE: at the end, SpriteStore imports Sprite
+import Myth.Models.SpriteStore
@@ -2,20 +2,31 @@ from PySide2.QtGui import *
 from PySide2.QtCore import *
 from PySide2.QtWidgets import *
 
+from Myth.Models.SpatialIndex import SpatialIndex
+from Myth.Models.SpriteStore import SpriteStore
 
 class SpriteListModel(QAbstractListModel):
     _selected = None
     _redrawing = None
+    # Slots of all selected sprites, including the current one in _selected.
+    # NOTE: replaced on every change instead of modified, so it can be compared by identity
+    _selection = frozenset()
 
-    def __init__(self, *args, sprites=[], sheet=None, **kwargs):
+    def __init__(self, *args, sprites=None, sheet=None, **kwargs):
         super(SpriteListModel, self).__init__(*args, **kwargs)
         self._sheet = sheet
-        self._sprites = sprites
+        self._sprites = sprites if sprites is not None else SpriteStore()
+
+        # NOTE: the index holds slots of the store, Sprite views are only created for results
+        store = self._sprites
+        self._index = SpatialIndex()
+        self._index.rebuild((slot, *store.geometry(slot)) for slot in store.slots())
+        store._index = self._index
 
     def data(self, index, role):
         if role == Qt.DisplayRole:
-            ss = self._sprites[index.row()]
-            return ss.name()
+            store = self._sprites
+            return store.name(store.slots()[index.row()])
 
     def rowCount(self, index):
         return len(self._sprites)
@@ -24,51 +35,154 @@ class SpriteListModel(QAbstractListModel):
         return self._sprites
 
     def findDupes(self, name):
-        dupes = filter(lambda s: s.name() == name, self._sprites)
-        if len(list(dupes)) > 0:
-            return True
-        return False
+        return self._sprites.find(name) is not None
 
-    def insertRow(self, sprite):
-        if self.findDupes(sprite.name()):
-            return False
+    def findSprite(self, name):
+        slot = self._sprites.find(name)
+        return self._sprites.view(slot) if slot is not None else None
 
-        l = len(self._sprites)
-        self.beginInsertRows(QModelIndex(), l, l+1)
-        self._sprites.append(sprite)
-        self.endInsertRows()
-        return True
+    def insertRow(self, sprite):
+        return len(self.insertSprites([sprite])) == 1
 
     def removeRow(self, sprite):
-        idx = self._sprites.index(sprite)
-        self.beginRemoveRows(QModelIndex(), idx, idx)
-        if self._selected == sprite:
+        self.removeSprites([sprite])
+
+    def insertSprites(self, sprites):
+        """
+        Appends the sprites with a single row notification, skipping the ones whose
+        name is already taken. Returns the sprites which were inserted.
+        """
+        store = self._sprites
+        names = set()
+        accepted = []
+        for spr in sprites:
+            name = spr.name()
+            if name in names or store.find(name) is not None:
+                continue
+            names.add(name)
+            accepted.append(spr)
+
+        if not accepted:
+            return accepted
+
+        l = len(store)
+        self.beginInsertRows(QModelIndex(), l, l + len(accepted) - 1)
+        for spr in accepted:
+            if spr.store() is store:
+                store.append(spr.slot())
+            else:
+                # Move the sprite into this store, so the caller's Sprite refers to it from now on
+                slot = store.add(spr.name(), spr.x(), spr.y(), spr.width(), spr.height(),
+                                 spr.isFlippedX(), spr.isFlippedY())
+                spr._rebind(store, slot)
+            self._index.insert(spr.slot(), *store.geometry(spr.slot()))
+        self.endInsertRows()
+        return accepted
+
+    def removeSprites(self, sprites):
+        """
+        Removes the sprites in a single pass. Contiguous rows get a single row
+        notification, anything else resets the model, which is cheaper for the
+        views than one notification per row.
+        """
+        store = self._sprites
+        slots = {spr.slot() for spr in sprites if spr.store() is store and store.isLive(spr.slot())}
+        if not slots:
+            return
+
+        if len(slots) == 1:
+            # NOTE: the only search of the order, the row is passed on to the store
+            rows = [store.row(next(iter(slots)))]
+        else:
+            rows = [row for row, slot in enumerate(store.slots()) if slot in slots]
+        contiguous = rows[-1] - rows[0] + 1 == len(rows)
+        if contiguous:
+            self.beginRemoveRows(QModelIndex(), rows[0], rows[-1])
+        else:
+            self.beginResetModel()
+
+        if self._selected is not None and self._selected.slot() in slots:
             self._selected = None
-        self._sprites.remove(sprite)
-        self.endRemoveRows()
+        if not self._selection.isdisjoint(slots):
+            self._selection = self._selection - slots
+        if len(slots) == 1:
+            store.remove(next(iter(slots)), rows[0])
+        else:
+            store.removeSlots(slots)
+        for slot in slots:
+            self._index.remove(slot)
+
+        if contiguous:
+            self.endRemoveRows()
+        else:
+            self.endResetModel()
+
+    def spatialIndex(self):
+        return self._index
 
     def hitTest(self, pos):
-        hit = []
-        for spr in self._sprites:
-            if spr.aabbTest(pos):
-                hit.append(spr)
-        return hit
+        store = self._sprites
+        px = pos.x()
+        py = pos.y()
+        return [store.view(slot) for slot in self._index.queryPoint(px, py)
+                if store.aabbTest(slot, px, py)]
+
+    def spritesInRect(self, rect):
+        store = self._sprites
+        return [store.view(slot)
+                for slot in self._index.queryRect(rect.x(), rect.y(), rect.width(), rect.height())]
 
     def selected(self):
+        """ The current sprite, which single sprite edits apply to. """
         return self._selected
 
     def setSelected(self, sprite):
         self._selected = sprite
+        self._selection = frozenset() if sprite is None else frozenset((sprite.slot(),))
 
     def setSelectedByName(self, spriteName):
-        for spr in self._sprites:
-            if spr.name() == spriteName:
-                self._selected = spr
-                return True
-        return False
+        spr = self.findSprite(spriteName)
+        if spr is None:
+            return False
+        self.setSelected(spr)
+        return True
 
     def clearSelection(self):
-        self._selected = None
+        self.setSelected(None)
+
+    def selection(self):
+        """ Frozen set of the slots of all selected sprites. """
+        return self._selection
+
+    def selectedSprites(self):
+        """ All selected sprites, in row order. """
+        store = self._sprites
+        sel = self._selection
+        if len(sel) == 1 and self._selected is not None:
+            return [self._selected]
+        return [store.view(slot) for slot in store.slots() if slot in sel]
+
+    def isSelected(self, sprite):
+        return sprite.slot() in self._selection and sprite.store() is self._sprites
+
+    def setSelection(self, sprites, current=None):
+        """ Selects a list of sprites, current defaults to the first one. """
+        if current is None and sprites:
+            current = sprites[0]
+        slots = frozenset(spr.slot() for spr in sprites)
+        if current is not None:
+            slots |= {current.slot()}
+        self._selected = current
+        self._selection = slots
+
+    def toggleSelected(self, sprite):
+        if sprite.slot() in self._selection:
+            self._selection = self._selection - {sprite.slot()}
+            if self._selected == sprite:
+                self._selected = self._sprites.view(next(iter(self._selection))) if self._selection else None
+        else:
+            self._selection = self._selection | {sprite.slot()}
+            self._selected = sprite
 
     def sheet(self):
         return self._sheet
@@ -0,0 +1,270 @@
+import sys
+from array import array
+
+from Myth.Models.Sprite import Sprite
+
+FLIP_X = 1
+FLIP_Y = 2
+# Set while the slot is part of the store's order
+_LIVE = 4
+
+
+def _whole(x, y, w, h):
+    """ The geometry as ints, raises ValueError for fractional values instead of truncating them. """
+    if type(x) is int and type(y) is int and type(w) is int and type(h) is int:
+        return x, y, w, h
+    values = (int(x), int(y), int(w), int(h))
+    if values != (x, y, w, h):
+        raise ValueError(f"geometry has to be in whole pixels: {x} {y} {w} {h}")
+    return values
+
+
+class SpriteStore:
+    """
+    Columnar storage for the sprites of a sheet.
+
+    Geometry is kept in contiguous int arrays and the flip bits in a bytearray, all
+    indexed by slot, with the names interned so sheets loaded again share them.
+    Sprite objects are only views of a slot, created on demand.
+
+    Slots are stable: removing a sprite only takes it's slot out of the order, so it
+    can be put back later (e.g. by undo) and views of it stay valid. Slots are never
+    reused, a store is simply replaced when the document is loaded again.
+
+    The sprites in the order are also indexed by name. Sheets can contain duplicate
+    names, for those the index points at one of the sprites and counts the others.
+    """
+
+    def __init__(self):
+        self._x = array("i")
+        self._y = array("i")
+        self._w = array("i")
+        self._h = array("i")
+        self._flags = bytearray()
+        self._names = []
+        # Slots of the sprites in the sheet, in order
+        self._order = []
+        # name -> slot of the sprites in the order, and the number of sprites for
+        # names which are used by more than one
+        self._byName = {}
+        self._dupes = {}
+        # SpatialIndex of the SpriteListModel currently displaying the store
+        self._index = None
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        for slot in self._order:
+            yield Sprite._view(self, slot)
+
+    def __getitem__(self, row):
+        return Sprite._view(self, self._order[row])
+
+    def view(self, slot):
+        return Sprite._view(self, slot)
+
+    def slots(self):
+        """ The slots in order. NOTE: this is the store's own list, don't modify it. """
+        return self._order
+
+    def names(self):
+        names = self._names
+        return (names[slot] for slot in self._order)
+
+    def row(self, slot):
+        return self._order.index(slot)
+
+    def isLive(self, slot):
+        return bool(self._flags[slot] & _LIVE)
+
+    def find(self, name):
+        """ Returns the slot of a sprite in the order with the name, or None. """
+        return self._byName.get(name)
+
+    def _indexName(self, slot):
+        name = self._names[slot]
+        if name in self._byName:
+            self._dupes[name] = self._dupes.get(name, 1) + 1
+        else:
+            self._byName[name] = slot
+
+    def _unindexName(self, slot):
+        name = self._names[slot]
+        count = self._dupes.get(name)
+        if count is None:
+            if self._byName.get(name) == slot:
+                del self._byName[name]
+            return
+
+        if count > 2:
+            self._dupes[name] = count - 1
+        else:
+            del self._dupes[name]
+        if self._byName.get(name) == slot:
+            names = self._names
+            other = next((s for s in self._order if s != slot and names[s] == name), None)
+            if other is None:
+                # NOTE: only while removeSlots() takes out all of the sprites with the name
+                del self._byName[name]
+            else:
+                self._byName[name] = other
+
+    def allocate(self, name, x, y, w, h, flipX=False, flipY=False):
+        """ Adds a sprite without putting it in the order, returns it's slot. """
+        x, y, w, h = _whole(x, y, w, h)
+        slot = len(self._names)
+        self._names.append(sys.intern(name))
+        self._flags.append((FLIP_X if flipX else 0) | (FLIP_Y if flipY else 0))
+        self._x.append(0)
+        self._y.append(0)
+        self._w.append(0)
+        self._h.append(0)
+        self._setGeometry(slot, x, y, w, h)
+        return slot
+
+    def add(self, name, x, y, w, h, flipX=False, flipY=False):
+        slot = self.allocate(name, x, y, w, h, flipX, flipY)
+        self.append(slot)
+        return slot
+
+    def append(self, slot):
+        self._flags[slot] |= _LIVE
+        self._order.append(slot)
+        self._indexName(slot)
+
+    def remove(self, slot, row=None):
+        """
+        Takes the slot out of the order, returns the row it was at. Pass the row if
+        it's already known, so the order isn't searched for it again.
+        """
+        if row is None:
+            row = self._order.index(slot)
+        self._unindexName(slot)
+        del self._order[row]
+        self._flags[slot] &= ~_LIVE
+        return row
+
+    def removeSlots(self, slots):
+        """ Takes a set of slots out of the order in a single pass. """
+        if len(slots) == 1:
+            self.remove(next(iter(slots)))
+            return
+
+        # NOTE: out of the order first, so the name index doesn't pick one of the
+        # removed slots as the new one for a duplicate name
+        self._order = [slot for slot in self._order if slot not in slots]
+        for slot in slots:
+            self._flags[slot] &= ~_LIVE
+            self._unindexName(slot)
+
+    def setOrder(self, slots):
+        for slot in self._order:
+            self._flags[slot] &= ~_LIVE
+        self._order = list(slots)
+        self._byName = {}
+        self._dupes = {}
+        for slot in self._order:
+            self._flags[slot] |= _LIVE
+            self._indexName(slot)
+
+    def name(self, slot):
+        return self._names[slot]
+
+    def setName(self, slot, name):
+        live = self._flags[slot] & _LIVE
+        if live:
+            self._unindexName(slot)
+        self._names[slot] = sys.intern(name)
+        if live:
+            self._indexName(slot)
+        self._touch()
+
+    def x(self, slot):
+        return self._x[slot]
+
+    def y(self, slot):
+        return self._y[slot]
+
+    def width(self, slot):
+        return self._w[slot]
+
+    def height(self, slot):
+        return self._h[slot]
+
+    def geometry(self, slot):
+        return self._x[slot], self._y[slot], self._w[slot], self._h[slot]
+
+    def isFlippedX(self, slot):
+        return bool(self._flags[slot] & FLIP_X)
+
+    def isFlippedY(self, slot):
+        return bool(self._flags[slot] & FLIP_Y)
+
+    def flipX(self, slot):
+        self._flags[slot] ^= FLIP_X
+        self._touch()
+
+    def flipY(self, slot):
+        self._flags[slot] ^= FLIP_Y
+        self._touch()
+
+    def setFlipped(self, slot, flipX, flipY):
+        flags = self._flags[slot] & ~(FLIP_X | FLIP_Y)
+        self._flags[slot] = flags | (FLIP_X if flipX else 0) | (FLIP_Y if flipY else 0)
+        self._touch()
+
+    def setGeometry(self, slot, x, y, w, h):
+        x, y, w, h = self._setGeometry(slot, x, y, w, h)
+        if self._index is not None:
+            self._index.update(slot, x, y, w, h)
+
+    def _setGeometry(self, slot, x, y, w, h):
+        x, y, w, h = _whole(x, y, w, h)
+        # If the sprite would have negative w/h then
+        # shift it into the positive for AABB testing
+        if w < 0:
+            x += w
+            w = -w
+            self._flags[slot] |= FLIP_X
+        if h < 0:
+            y += h
+            h = -h
+            self._flags[slot] |= FLIP_Y
+        self._x[slot] = x
+        self._y[slot] = y
+        self._w[slot] = w
+        self._h[slot] = h
+        return x, y, w, h
+
+    def _touch(self):
+        # Let anything caching the sprites' appearance know that they changed
+        if self._index is not None:
+            self._index.touch()
+
+    def aabbTest(self, slot, px, py):
+        rx = self._x[slot]
+        ry = self._y[slot]
+        return rx < px < rx + self._w[slot] and ry < py < ry + self._h[slot]
+
+    def toRCSS(self, slot):
+        x = self._x[slot]
+        y = self._y[slot]
+        w = self._w[slot]
+        h = self._h[slot]
+        flags = self._flags[slot]
+
+        # NOTE: if we shifted the image during image loading then shift it back, as
+        # otherwise mirrored images will be wrong in RmlUI.
+        if flags & FLIP_X:
+            w = -w
+            x -= w
+        if flags & FLIP_Y:
+            h = -h
+            y -= h
+
+        return f"{self._names[slot]}: {x}px {y}px {w}px {h}px;"
+
+
+# Sprites created on their own, until they're inserted into a sheet
+Sprite._scratch = SpriteStore()
@@ -1,3 +1,6 @@
+import io
+
+from Myth.SpritesheetScanner import BlockDigestWriter
 
 class SpritesheetError(ValueError):
     def __init__(self, message):
@@ -7,12 +10,15 @@ class SpritesheetError(ValueError):
 class Spritesheet:
     def __init__(self, basepath, linerange, name, sprites, src="none", resolution=None):
         self._name = name
+        # SpriteStore of the sheet
         self._sprites = sprites
         self._basepath = basepath
         self._linerange = linerange
 
         self._src = src
         self._resolution = resolution
+        # Digest of the block in the file as of the last load or save, see blockDigest()
+        self._blockDigest = None
 
     def basepath(self):
         return self._basepath
@@ -26,6 +32,12 @@ class Spritesheet:
     def setLinerange(self, range):
         self._linerange = range
 
+    def blockDigest(self):
+        return self._blockDigest
+
+    def setBlockDigest(self, digest):
+        self._blockDigest = digest
+
     def resolution(self):
         return self._resolution
 
@@ -50,21 +62,131 @@ class Spritesheet:
     def sprites(self):
         return self._sprites
 
-    def serialize(self):
-        ret = f"@spritesheet {self._name}\n"
-        ret += "{\n"
-
-        ret += f"\t/* Path: {self.sourceLongPath()} */\n"
-        ret += f"\tsrc: {self._src};\n"
+    def replaceSprites(self, sprites):
+        """
+        Makes the sheet's sprites match the ones in the given store, keeping the slots
+        of existing sprites with the same names, so Sprites referring to them stay valid.
+        """
+        store = self._sprites
+        existing = {}
+        for slot in store.slots():
+            existing.setdefault(store.name(slot), slot)
+
+        result = []
+        for new in sprites.slots():
+            name = sprites.name(new)
+            flipX = sprites.isFlippedX(new)
+            flipY = sprites.isFlippedY(new)
+            slot = existing.pop(name, None)
+            if slot is None:
+                result.append(store.allocate(name, *sprites.geometry(new), flipX, flipY))
+                continue
+
+            store.setFlipped(slot, flipX, flipY)
+            store.setGeometry(slot, *sprites.geometry(new))
+            result.append(slot)
+
+        store.setOrder(result)
+
+    def write(self, fd):
+        """
+        Writes the spritesheet into a text file object, one sprite at a time.
+        Returns the number of lines written.
+        """
+        fd.write(f"@spritesheet {self._name}\n")
+        fd.write("{\n")
+
+        fd.write(f"\t/* Path: {self.sourceLongPath()} */\n")
+        fd.write(f"\tsrc: {self._src};\n")
+        lines = 4
 
         if self._resolution:
-            ret += f"\tresolution: {self._resolution}x;\n"
+            fd.write(f"\tresolution: {self._resolution}x;\n")
+            lines += 1
+
+        fd.write("\n")
 
-        ret += "\n"
+        store = self._sprites
+        fd.writelines(f"\t{store.toRCSS(slot)}\n" for slot in store.slots())
 
-        for s in self._sprites:
-            ret += f"\t{s.toRCSS()}\n"
+        fd.write("}\n")
 
-        ret += "}\n"
+        return lines + len(self._sprites) + 2
 
-        return ret
+    def writeHashed(self, fd):
+        """ Same as write, but also returns the digest of the written block. """
+        hashing = BlockDigestWriter(fd)
+        lines = self.write(hashing)
+        return lines, hashing.digest()
+
+    def serialize(self):
+        buf = io.StringIO()
+        self.write(buf)
+        return buf.getvalue()
+
+
+def spliceSpritesheets(src, dst, sheets):
+    """
+    Copies the lines of the src text file object to dst in a single pass, replacing the
+    line range of every sheet with its current contents. Sheets whose ranges overlap are
+    written together at the first line of the combined range, in the given order, and
+    sheets without a range are written after the last range (or at the end of the file).
+
+    Returns the new line range and block digest of every sheet, in the order of sheets.
+    """
+    # Sorted interval table of [start, end, sheets], overlapping ranges merged together
+    order = {id(s): i for i, s in enumerate(sheets)}
+    groups = []
+    for sheet in sorted((s for s in sheets if s.linerange()), key=lambda s: s.linerange()[0]):
+        start, end = sheet.linerange()
+        if groups and start <= groups[-1][1]:
+            groups[-1][1] = max(groups[-1][1], end)
+            groups[-1][2].append(sheet)
+        else:
+            groups.append([start, end, [sheet]])
+
+    # Keep the sheets of a merged range in the given order
+    for g in groups:
+        g[2].sort(key=lambda s: order[id(s)])
+
+    unplaced = [s for s in sheets if not s.linerange()]
+    if unplaced:
+        if groups:
+            groups[-1][2].extend(unplaced)
+        else:
+            groups.append([float("inf"), float("inf"), unplaced])
+
+    ranges = {}
+    out = 0
+    endsWithNewline = True
+
+    def writeGroup(group):
+        nonlocal out
+        if not endsWithNewline:
+            dst.write("\n")
+        for sheet in group[2]:
+            lines, digest = sheet.writeHashed(dst)
+            ranges[id(sheet)] = ((out, out + lines - 1), digest)
+            out += lines
+
+    gi = 0
+    for i, line in enumerate(src):
+        if gi < len(groups) and i >= groups[gi][0]:
+            if i == groups[gi][0]:
+                writeGroup(groups[gi])
+                endsWithNewline = True
+            if i >= groups[gi][1]:
+                gi += 1
+            continue
+
+        dst.write(line)
+        out += 1
+        endsWithNewline = line.endswith("\n")
+
+    # Ranges past the end of the file
+    for group in groups[gi:]:
+        if id(group[2][0]) not in ranges:
+            writeGroup(group)
+            endsWithNewline = True
+
+    return [ranges[id(s)] for s in sheets]
@@ -10,6 +10,9 @@ class SpritesheetListModel(QAbstractListModel):
     def __init__(self, *args, sheets=[], **kwargs):
         super(SpritesheetListModel, self).__init__(*args, **kwargs)
         self._sheets = sheets
+        # name -> sheet, see findSheet()
+        self._byName = {}
+        self._reindex()
 
     def data(self, index, role):
         if role == Qt.DisplayRole:
@@ -20,16 +23,49 @@ class SpritesheetListModel(QAbstractListModel):
         return len(self._sheets)
 
     def insertRow(self, sheet):
+        return self.insertSheets([sheet])
+
+    def insertSheets(self, sheets):
+        """ Appends the sheets with a single row notification. """
+        if not sheets:
+            return False
+
         l = len(self._sheets)
-        self.beginInsertRows(QModelIndex(), l, l+1)
-        self._sheets.append(sheet)
+        self.beginInsertRows(QModelIndex(), l, l + len(sheets) - 1)
+        for sheet in sheets:
+            self._sheets.append(sheet)
+            self._byName.setdefault(sheet.name(), sheet)
         self.endInsertRows()
         return True
 
-    def getSheetListModel(self, sheetName):
+    def removeRow(self, sheet):
+        idx = self._sheets.index(sheet)
+        self.beginRemoveRows(QModelIndex(), idx, idx)
+        if self._selected is sheet:
+            self._selected = None
+        del self._sheets[idx]
+        if self._byName.get(sheet.name()) is sheet:
+            self._reindex()
+        self.endRemoveRows()
+
+    def _reindex(self):
+        self._byName = {}
         for s in self._sheets:
-            if s.name() == sheetName:
-                return SpriteListModel(sprites=s.sprites(), sheet=s)
+            self._byName.setdefault(s.name(), s)
+
+    def findSheet(self, sheetName):
+        """ Returns the first sheet with the name, or None. """
+        s = self._byName.get(sheetName)
+        if s is None or s.name() != sheetName:
+            # NOTE: sheets can be renamed behind our back, so a miss rebuilds the index
+            self._reindex()
+            s = self._byName.get(sheetName)
+        return s
+
+    def getSheetListModel(self, sheetName):
+        s = self.findSheet(sheetName)
+        if s is not None:
+            return SpriteListModel(sprites=s.sprites(), sheet=s)
 
     def setSheetImage(self, sheet, image):
         sheet.setSource(image)
@@ -38,9 +74,9 @@ class SpritesheetListModel(QAbstractListModel):
         if sheetName is None:
             sheetName = self._selected.name()
 
-        for s in self._sheets:
-            if s.name() == sheetName:
-                return f"{s.basepath()}/{s.source()}"
+        s = self.findSheet(sheetName)
+        if s is not None:
+            return f"{s.basepath()}/{s.source()}"
 
     def sheets(self):
         return self._sheets
@@ -49,11 +85,11 @@ class SpritesheetListModel(QAbstractListModel):
         return self._selected
 
     def setSelectedByName(self, sheetName):
-        for s in self._sheets:
-            if s.name() == sheetName:
-                self._selected = s
-                return True
-        return False
+        s = self.findSheet(sheetName)
+        if s is None:
+            return False
+        self._selected = s
+        return True
 
     def clearSelection(self):
         self._selected = None
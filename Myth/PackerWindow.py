@@ -1,5 +1,7 @@
 import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import Myth.Util
 
 from PySide2.QtCore import *
@@ -13,11 +15,21 @@ from MythPack.SpritePacker import SpritePacker, PackerException
 
 class PackerWindow(QDialog):
     _color = 0x00000000
-
-    def __init__(self):
+    # Space between the pages in the preview
+    previewSpacing = 8
+    # Pages past this height aren't added to the preview
+    previewMaxHeight = 8192
+    # Problems reading the inputs listed when saving
+    maxListedErrors = 20
+
+    def __init__(self, inputCache=None):
         QDialog.__init__(self)
+        # Shared with the other packer windows so the inputs are only read once
+        self.inputCache = inputCache
         UiLoader.load_ui("ui/packer.ui", self)
 
+        self.methodComboBox.addItems(SpritePacker.methods())
+
         self.previewButton.clicked.connect(self._cb_generatePreview)
         self.bgColorButton.clicked.connect(self._cb_selectColor)
 
@@ -35,14 +47,34 @@ class PackerWindow(QDialog):
             "shape_padding": self.shapePaddingSpinBox.value(),
             "inner_padding": self.innerPaddingSpinBox.value(),
             "force_square": self.squareOutputCheckBox.isChecked(),
-            "enable_rotated": False
+            "enable_rotated": False,
+            "method": self.methodComboBox.currentText()
         }
 
+        self.loadErrors = []
         try:
-            packer = SpritePacker(loadPath, True)
+            packer = SpritePacker(loadPath, True, self.workers(), self._cb_loadProgress, self.inputCache,
+                                  self.loadErrors.append)
             return packer.pack(**kwargs)
         except PackerException as e:
-            QMessageBox.critical(self, self.windowTitle(), str(e))
+            return [], str(e)
+
+    def workers(self):
+        # 0 uses a thread per core
+        return int(QSettings().value("packerWorkers", 0))
+
+    @staticmethod
+    def pagePath(imagePath, page):
+        """ The file a page is written to, pages after the first get numbered from 2. """
+        if page == 0:
+            return imagePath
+        root, ext = os.path.splitext(imagePath)
+        return f"{root}-{page + 1}{ext}"
+
+    def _cb_loadProgress(self, done, total):
+        self.infoLabel.setStyleSheet("")
+        self.infoLabel.setText(f"Reading images {done}/{total}")
+        QCoreApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
 
     def _cb_selectColor(self):
         color = QColorDialog.getColor(parent=self, title="Choose background color",
@@ -59,8 +91,8 @@ class PackerWindow(QDialog):
             QMessageBox.warning(self, self.windowTitle(), "Please enter the input directory")
             return
 
-        img, sprites, error = self.generate(loadPath)
-        if not img:
+        pages, error = self.generate(loadPath)
+        if not pages:
             self.infoLabel.setStyleSheet("color: rgb(255, 0, 4);")
             self.infoLabel.setText(error)
             return
@@ -69,10 +101,44 @@ class PackerWindow(QDialog):
             self.infoLabel.setStyleSheet("color: rgb(255, 0, 4);")
             self.infoLabel.setText(error)
         else:
+            sizes = ", ".join(f"{img.width()}x{img.height()}" for img, _ in pages)
+            count = sum(len(sprites) for _, sprites in pages)
             self.infoLabel.setStyleSheet("color: rgb(0, 255, 4);")
-            self.infoLabel.setText(f"Successfully generated sheet {img.width()}x{img.height()} with {len(sprites)} sprites")
-
-        self.imageLabel.setPixmap(QPixmap.fromImage(img))
+            self.infoLabel.setText(f"Successfully generated {len(pages)} sheets ({sizes}) with {count} sprites")
+
+        pixmap, shown = self.previewPixmap(pages)
+        if shown < len(pages):
+            self.infoLabel.setText(self.infoLabel.text() + f", previewing the first {shown}")
+        if self.loadErrors:
+            self.infoLabel.setText(self.infoLabel.text() + f", {len(self.loadErrors)} problems reading the inputs")
+        self.infoLabel.setToolTip("\n".join(self.loadErrors))
+        self.imageLabel.setPixmap(pixmap)
+
+    def previewPixmap(self, pages):
+        """
+        The pages below each other, as many as fit into previewMaxHeight but at least
+        the first one. Returns the pixmap and the number of pages in it.
+        """
+        height = pages[0][0].height()
+        shown = 1
+        for img, _ in pages[1:]:
+            if height + self.previewSpacing + img.height() > self.previewMaxHeight:
+                break
+            height += self.previewSpacing + img.height()
+            shown += 1
+        pages = pages[:shown]
+
+        width = max(img.width() for img, _ in pages)
+        pixmap = QPixmap(width, height)
+        pixmap.fill(Qt.transparent)
+
+        painter = QPainter(pixmap)
+        y = 0
+        for img, _ in pages:
+            painter.drawImage(0, y, img)
+            y += img.height() + self.previewSpacing
+        painter.end()
+        return pixmap, shown
 
     def _cb_inputBrowse(self):
         loadPath = QFileDialog.getExistingDirectory(self,
@@ -109,25 +175,41 @@ class PackerWindow(QDialog):
                                 "Please enter input and output directories")
             return
 
-        img, sprites, error = self.generate(loadPath)
-        if not img or not sprites or error:
+        pages, error = self.generate(loadPath)
+        if not pages or error:
             errmsg = error if error else "Failed to generate spritesheet"
             QMessageBox.critical(self, self.windowTitle(), errmsg)
             return
 
-        writer = QImageWriter(imagePath, bytes(self._outFmt, "utf8"))
-        if not writer.write(img):
-            QMessageBox.critical(self, self.windowTitle(),
-                                 f"Error writing image: {writer.error()}")
+        if self.loadErrors:
+            QMessageBox.warning(self, self.windowTitle(), "Problems reading the inputs, the files were left out:\n"
+                                + "\n".join(self.loadErrors[:self.maxListedErrors]))
+
+        paths = [self.pagePath(imagePath, i) for i in range(len(pages))]
+        fmt = bytes(self._outFmt, "utf8")
+
+        def write(img, path):
+            writer = QImageWriter(path, fmt)
+            if not writer.write(img):
+                return f"Error writing image {path}: {writer.errorString()}"
+
+        # NOTE: QImageWriter is reentrant, so the pages are encoded in parallel
+        with ThreadPoolExecutor(max_workers=min(self.workers() or os.cpu_count() or 1, len(pages))) as pool:
+            errors = [e for e in pool.map(write, (img for img, _ in pages), paths) if e]
+        if errors:
+            QMessageBox.critical(self, self.windowTitle(), "\n".join(errors))
             return
 
-        file = os.path.basename(imagePath)
-        base = os.path.dirname(imagePath)
+        self.generatedSheets = []
+        for i, (path, (_, sprites)) in enumerate(zip(paths, pages)):
+            file = os.path.basename(path)
+            base = os.path.dirname(path)
 
-        if len(base) == 0:
-            base = "."
+            if len(base) == 0:
+                base = "."
 
-        self.generatedSheet = Spritesheet(base, None, "packed", sprites, file)
+            name = "packed" if i == 0 else f"packed-{i + 1}"
+            self.generatedSheets.append(Spritesheet(base, None, name, sprites, file))
 
         self.done(1)
 
@@ -0,0 +1,153 @@
+import json
+import os
+
+from tinycss.css21 import Stylesheet
+
+from Myth.Models.SpriteStore import SpriteStore
+from Myth.RCSSParser import SpritesheetRule
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed stylesheets, keyed by the digest of the file contents.
+
+    Only what loading a document needs is stored: the spritesheets with their line
+    ranges, props and sprites, the parser errors (as text) and the spritesheet
+    error flag. Each entry is a JSON file named after the digest, and the least
+    recently used entries are removed when there are more than maxEntries of them
+    or they take more than maxBytes.
+    """
+    # NOTE: bump this whenever the stored data or the parser output changes
+    formatVersion = 3
+
+    def __init__(self, directory, maxEntries=32, maxBytes=64 * 1024 * 1024):
+        self._directory = directory
+        self._maxEntries = maxEntries
+        self._maxBytes = maxBytes
+
+    def directory(self):
+        return self._directory
+
+    def setLimits(self, maxEntries, maxBytes):
+        self._maxEntries = maxEntries
+        self._maxBytes = maxBytes
+        self._trim()
+
+    def _path(self, digest):
+        return os.path.join(self._directory, f"{digest}.json")
+
+    def get(self, digest):
+        """
+        Returns (stylesheet, hadSpritesheetError) for the digest, or None on a cache miss.
+        """
+        path = self._path(digest)
+        try:
+            with open(path, "r", encoding="utf-8") as fd:
+                entry = json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("version") != self.formatVersion or entry.get("digest") != digest:
+            self._remove(path)
+            return None
+
+        try:
+            rules = [self._loadSheet(s) for s in entry["sheets"]]
+            errors = list(entry["errors"])
+            hadError = bool(entry["hadSpritesheetError"])
+        except (KeyError, TypeError, ValueError):
+            self._remove(path)
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return Stylesheet(rules, errors, entry.get("encoding")), hadError
+
+    def put(self, digest, stylesheet, hadSpritesheetError):
+        entry = {
+            "version": self.formatVersion,
+            "digest": digest,
+            "encoding": stylesheet.encoding,
+            "sheets": [self._dumpSheet(r) for r in stylesheet.rules if r.at_keyword == "@spritesheet"],
+            "errors": [str(e) for e in stylesheet.errors],
+            "hadSpritesheetError": hadSpritesheetError,
+        }
+
+        path = self._path(digest)
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fd:
+                json.dump(entry, fd, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not write parse cache entry {path}: {e}")
+            return
+
+        self._trim()
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            self._remove(path)
+
+    def _entries(self):
+        """ (path, mtime, size) of all cache entries, least recently used first. """
+        entries = []
+        try:
+            with os.scandir(self._directory) as it:
+                for e in it:
+                    if not e.name.endswith(".json"):
+                        continue
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    entries.append((e.path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            return []
+
+        entries.sort(key=lambda e: e[1])
+        return entries
+
+    def _trim(self):
+        entries = self._entries()
+        total = sum(e[2] for e in entries)
+        while entries and (len(entries) > self._maxEntries or total > self._maxBytes):
+            path, _, size = entries.pop(0)
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _dumpSheet(self, rule):
+        store = rule.declarations
+        sprites = []
+        for slot in store.slots():
+            sprites.append([store.name(slot), *store.geometry(slot),
+                            store.isFlippedX(slot), store.isFlippedY(slot)])
+
+        return {
+            "name": rule.name,
+            "line": rule.line,
+            "column": rule.column,
+            "endline": rule.endline,
+            "digest": rule.digest,
+            "props": rule.props,
+            "sprites": sprites,
+        }
+
+    def _loadSheet(self, data):
+        sprites = SpriteStore()
+        for name, x, y, w, h, flipX, flipY in data["sprites"]:
+            sprites.add(name, x, y, w, h, flipX, flipY)
+
+        return SpritesheetRule(data["name"], sprites, data["props"], [],
+                               data["line"], data["column"], data["endline"], data["digest"])
@@ -1,14 +1,19 @@
+import sys
+
 import tinycss
+from tinycss.css21 import Stylesheet
+from tinycss.decoding import decode
 from tinycss.parsing import ParseError
 from functools import reduce
 
-from Myth.Models.Sprite import Sprite
+from Myth.Models.SpriteStore import SpriteStore
+from Myth.SpritesheetScanner import ScanError, locateSpritesheets, parseName, parseDeclarations
 
 
 class SpritesheetRule(object):
     at_keyword = '@spritesheet'
 
-    def __init__(self, name, declarations, props, at_rules, line, column, endline):
+    def __init__(self, name, declarations, props, at_rules, line, column, endline, digest=None):
         self.name = name
         self.props = props
         self.declarations = declarations
@@ -16,6 +21,8 @@ class SpritesheetRule(object):
         self.line = line
         self.column = column
         self.endline = endline
+        # Digest of the block's source (see SpritesheetScanner.blockDigest), if known
+        self.digest = digest
 
     def __repr__(self):
         return ('<{0.__class__.__name__} {0.line}:{0.column}'
@@ -33,12 +40,101 @@ class RCSSProp:
         return value
 
 
+RESERVED_PROPS = {
+    "src": RCSSProp(str, True),
+    "resolution": RCSSProp(float, False)
+}
+
+
 class RCSSParser(tinycss.CSS21Parser):
-    def __init__(self):
+    """
+    Parser for the @spritesheet rules of RCSS files.
+
+    With fastPath enabled (the default) parse_stylesheet_file only looks at the
+    @spritesheet blocks, using SpritesheetScanner, instead of tokenizing and parsing
+    every rule in the file. Blocks the scanner can't handle are parsed with tinycss
+    on their own, and if the structure of the whole file is too unusual then the
+    whole file is parsed with tinycss.
+    Other rules are skipped by the fast path, so neither they nor their errors
+    appear in the resulting stylesheet.
+    """
+    def __init__(self, fastPath=True):
         # A bit of a HACK :)
         self.hadSpritesheetError = False
+        self.fastPath = fastPath
         super().__init__()
 
+    def parse_stylesheet_file(self, css_file, protocol_encoding=None,
+                              linking_encoding=None, document_encoding=None):
+        if not self.fastPath:
+            return super().parse_stylesheet_file(css_file, protocol_encoding,
+                                                 linking_encoding, document_encoding)
+
+        if hasattr(css_file, 'read'):
+            css_bytes = css_file.read()
+        else:
+            with open(css_file, 'rb') as fd:
+                css_bytes = fd.read()
+
+        css_unicode, encoding = decode(css_bytes, protocol_encoding,
+                                       linking_encoding, document_encoding)
+        try:
+            blocks = locateSpritesheets(css_unicode)
+        except ScanError:
+            blocks = []
+
+        if not blocks:
+            # NOTE: also when there are no spritesheets, so the errors of the other
+            # rules can be shown instead
+            return self.parse_stylesheet(css_unicode, encoding=encoding)
+
+        rules = []
+        errors = []
+        for block in blocks:
+            blockRules, blockErrors = self.parse_block(block)
+            rules.extend(blockRules)
+            errors.extend(blockErrors)
+
+        return Stylesheet(rules, errors, encoding)
+
+    def parse_block(self, block):
+        """
+        Parses a single block found by locateSpritesheets, using tinycss if the fast
+        path can't handle it. Returns the rules and errors.
+        """
+        errors = []
+        try:
+            rules = [self.parse_spritesheet_block(block, errors)]
+        except ScanError:
+            # Pad the block so tinycss gives the same line and column numbers
+            padded = "\n" * (block.line - 1) + " " * (block.column - 1) + block.source()
+            css = self.parse_stylesheet(padded)
+            rules = css.rules
+            errors = css.errors
+
+        digest = block.digest()
+        for r in rules:
+            if r.at_keyword == "@spritesheet":
+                r.digest = digest
+
+        return rules, errors
+
+    def parse_spritesheet_block(self, block, errors):
+        """
+        Parses a block found by locateSpritesheets without tinycss.
+        Raises ScanError if the block has to be parsed by tinycss instead.
+        """
+        if block.endline is None:
+            raise ScanError("unsupported end of @spritesheet block")
+
+        name = parseName(block.head)
+        entries = parseDeclarations(block.body(), RESERVED_PROPS)
+
+        ss_decls, props, decl_errors = self.build_spritesheet_declarations(entries)
+        errors.extend(decl_errors)
+
+        return SpritesheetRule(name, ss_decls, props, [], block.line, block.column, block.endline)
+
     def parse_spritesheet_name(self, head):
         if len(head) == 1 and head[0].type == "IDENT":
             return head[0].value
@@ -46,45 +142,48 @@ class RCSSParser(tinycss.CSS21Parser):
         return "UNNAMED"
 
     def parse_spritesheet_declarations(self, input_decls):
-        reservedProps = {
-            "src": RCSSProp(str, True),
-            "resolution": RCSSProp(float, False)
-        }
-        reservedPropsGot = []
-        props = dict()
-        decls = []
-        errors = []
-
+        entries = []
         for d in input_decls:
-            # A bit of a HACK, in the try block we're checking if it's a reserved prop,
-            # which throws on failure and then gets parsed as a regular property ;)
-            try:
-                rprop = reservedProps[d.name]
+            if d.name in RESERVED_PROPS:
                 # Since all the reserved props are a single value then concat every token
                 # that belongs to these props.
-                s = "".join(list(map(lambda v: str(v.value), d.value)))
+                entries.append((d.name, "".join(list(map(lambda v: str(v.value), d.value))), None))
+            else:
+                entries.append((d.name, None, [t.value for t in d.value if t.type != "S"]))
 
-                reservedPropsGot.append(d.name)
+        return self.build_spritesheet_declarations(entries)
+
+    def build_spritesheet_declarations(self, entries):
+        """
+        Builds the sprites and props from (name, text, values) tuples, where reserved
+        props have their value as text and everything else is a sprite with a list of values.
+        The sprites are added straight into a new SpriteStore.
+        """
+        reservedPropsGot = []
+        props = dict()
+        decls = SpriteStore()
+        errors = []
 
-                props[d.name] = rprop.cast(s)
-            except KeyError:
-                sprite_props = []
-                for t in d.value:
-                    if t.type == "S":
-                        continue
-                    sprite_props.append(t.value)
+        for name, text, sprite_props in entries:
+            rprop = RESERVED_PROPS.get(name)
+            if rprop:
+                reservedPropsGot.append(name)
+                props[name] = rprop.cast(text)
+                continue
 
-                prop_count = len(sprite_props)
-                if prop_count != 4:
-                    errors.append(f"Sprite {d.name} has {prop_count} props, expected 4")
-                    self.hadSpritesheetError = True
-                    continue
+            prop_count = len(sprite_props)
+            if prop_count != 4:
+                errors.append(f"Sprite {name} has {prop_count} props, expected 4")
+                self.hadSpritesheetError = True
+                continue
 
-                decls.append(Sprite(d.name,
-                                    sprite_props[0], sprite_props[1],
-                                    sprite_props[2], sprite_props[3]))
+            try:
+                decls.add(name, sprite_props[0], sprite_props[1], sprite_props[2], sprite_props[3])
+            except (TypeError, ValueError) as e:
+                errors.append(f"Sprite {name}: {e}")
+                self.hadSpritesheetError = True
 
-        for k,v in reservedProps.items():
+        for k,v in RESERVED_PROPS.items():
             if k not in reservedPropsGot and v.required:
                 self.hadSpritesheetError = True
                 errors.append(f"Missing required property of type {v.type.__name__}: {k}")
@@ -104,11 +203,11 @@ class RCSSParser(tinycss.CSS21Parser):
             ss_decls, props, decl_errors = self.parse_spritesheet_declarations(declarations)
             errors.extend(decl_errors)
 
-            endline = None
-
+            # NOTE: the closing brace isn't part of the body, so count the newlines in
+            # trailing whitespace to get it's line.
             lasttok = rule.body[-1]
-            if lasttok.value == "\n":
-                endline = lasttok.line + 1
+            if lasttok.type == "S":
+                endline = lasttok.line + lasttok.value.count("\n")
             else:
                 endline = lasttok.line
 
@@ -116,3 +215,66 @@ class RCSSParser(tinycss.CSS21Parser):
         else:
             return super().parse_at_rule(rule, previous_rules, errors, context)
 
+
+
+def _summarize(filename, fastPath):
+    parser = RCSSParser(fastPath=fastPath)
+    try:
+        css = parser.parse_stylesheet_file(filename)
+    except Exception as e:
+        # Both paths should fail the same way too
+        return f"{type(e).__name__}: {e}", None
+
+    sheets = []
+    for r in css.rules:
+        if r.at_keyword != "@spritesheet":
+            continue
+        sprites = [(s.name(), s.x(), s.y(), s.width(), s.height(), s.isFlippedX(), s.isFlippedY())
+                   for s in r.declarations]
+        sheets.append((r.name, r.line, r.column, r.endline, sorted(r.props.items()), sprites))
+    return sheets, parser.hadSpritesheetError
+
+
+def compare(filename):
+    """
+    Parses the file with and without the fast path.
+    Returns a list of differences, which is empty if both gave the same spritesheets.
+    """
+    fastSheets, fastError = _summarize(filename, True)
+    slowSheets, slowError = _summarize(filename, False)
+
+    if isinstance(fastSheets, str) or isinstance(slowSheets, str):
+        if fastSheets != slowSheets:
+            return [f"parsing failed: fast {fastSheets!r}, tinycss {slowSheets!r}"]
+        return []
+
+    diffs = []
+    if fastError != slowError:
+        diffs.append(f"spritesheet error flag: fast {fastError}, tinycss {slowError}")
+    if len(fastSheets) != len(slowSheets):
+        diffs.append(f"spritesheet count: fast {len(fastSheets)}, tinycss {len(slowSheets)}")
+    for f, s in zip(fastSheets, slowSheets):
+        if f != s:
+            diffs.append(f"spritesheet {s[0]} at line {s[1]}: fast {f}, tinycss {s}")
+    return diffs
+
+
+if __name__ == "__main__":
+    # Usage: python -m Myth.RCSSParser --compare FILE...
+    args = sys.argv[1:]
+    if not args or args[0] != "--compare":
+        print("Usage: python -m Myth.RCSSParser --compare FILE...")
+        sys.exit(2)
+
+    failed = 0
+    for fn in args[1:]:
+        diffs = compare(fn)
+        if diffs:
+            failed += 1
+            print(f"{fn}: DIFFERENT")
+            for d in diffs:
+                print(f"    {d}")
+        else:
+            print(f"{fn}: OK")
+
+    sys.exit(1 if failed else 0)
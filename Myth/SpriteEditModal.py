@@ -5,12 +5,21 @@ from PySide2.QtWidgets import *
 from Myth.UiLoader import UiLoader
 
 class SpriteEditModal(QDialog):
+    sprite = None
+    # Milliseconds between live preview updates, about one frame
+    previewInterval = 16
+
     def __init__(self, sprite=None, parent=None):
         QDialog.__init__(self)
         UiLoader.load_ui("ui/edit.ui", self)
 
         self.parent = parent
 
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(self.previewInterval)
+        self.previewTimer.timeout.connect(self._cb_updatePreview)
+
         if sprite:
             self.startName = sprite.name()
             self.startX = sprite.x()
@@ -37,37 +46,34 @@ class SpriteEditModal(QDialog):
         self.show()
 
     def _cb_change(self, prop, val):
-        if prop == "name":
-            self.sprite.setName(val)
-        elif prop == "x":
-            # NOTE: for both x and y edits reset the width/height as well, because otherwise
-            # the rect gets smaller during x/y movement (even though the width/height are never
-            # changed). I'm unsure if this is the correct way to cause a rect update, but it works.
-            self.sprite.setX(val)
-            self.sprite.setWidth(self.widthSpinBox.value())
-        elif prop == "y":
-            self.sprite.setY(val)
-            self.sprite.setHeight(self.heightSpinBox.value())
-        elif prop == "w":
-            self.sprite.setWidth(val)
-        elif prop == "h":
-            self.sprite.setHeight(val)
-        else:
-            print(f"Unsupported prop: {e}")
-
+        # NOTE: spin boxes scrolled with the mouse wheel change many times per frame, so the
+        # preview is only updated once the timer fires, with whatever the fields contain then.
+        if not self.previewTimer.isActive():
+            self.previewTimer.start()
+
+    def _cb_updatePreview(self):
+        if not self.sprite:
+            return
+
+        old = (self.sprite.x(), self.sprite.y(), self.sprite.width(), self.sprite.height())
+        if self.sprite.name() != self.nameEdit.text():
+            self.sprite.setName(self.nameEdit.text())
+        self.sprite.setSize(self.xSpinBox.value(), self.ySpinBox.value(),
+                            self.widthSpinBox.value(), self.heightSpinBox.value())
+        self._repaintParent(old)
+
+    def _repaintParent(self, old):
+        new = (self.sprite.x(), self.sprite.y(), self.sprite.width(), self.sprite.height())
         if self.parent:
-            self.parent.repaint()
+            self.parent.repaintSpriteArea(old, new)
 
     def resetSprite(self):
+        self.previewTimer.stop()
         if self.sprite:
+            old = (self.sprite.x(), self.sprite.y(), self.sprite.width(), self.sprite.height())
             self.sprite.setName(self.startName)
-            self.sprite.setX(self.startX)
-            self.sprite.setY(self.startY)
-            self.sprite.setWidth(self.startW)
-            self.sprite.setHeight(self.startH)
-
-        if self.parent:
-            self.parent.repaint()
+            self.sprite.setSize(self.startX, self.startY, self.startW, self.startH)
+            self._repaintParent(old)
 
     def accept(self):
         self.resetSprite()
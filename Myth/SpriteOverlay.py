@@ -0,0 +1,240 @@
+import math
+from collections import OrderedDict
+
+from PySide2.QtGui import *
+from PySide2.QtCore import *
+
+
+class SpriteOverlay:
+    """
+    Draws sprite outlines, diagonals, names and flip indicators over the image.
+
+    Everything except the selected sprites is rendered into a cache of fixed size
+    tiles (in widget pixels), which is only thrown away when the zoom or draw
+    options change. When sprites move only the tiles around their old and new
+    positions are dropped, as far as the spatial index still remembers them.
+    Painting blits the cached tiles intersecting the exposed area, rendering
+    missing ones using only the sprites inside them, and then draws the selected
+    sprites on top.
+    """
+
+    tileSize = 256
+    maxTiles = 128
+    # Selection changes touching more sprites than this drop all tiles at once
+    maxDroppedSprites = 64
+
+    outlinePen = QPen(Qt.black)
+    selectedPen = QPen(Qt.red, 3)
+
+    def __init__(self):
+        self._tiles = OrderedDict()
+        self._key = None
+        self._revision = None
+        self._count = 0
+        self._selection = frozenset()
+        self._margin = (0, 0)
+        # What the margin was computed for, it doesn't depend on the zoom
+        self._marginKey = None
+        self._marginRevision = None
+
+    def invalidate(self):
+        self._tiles.clear()
+        self._key = None
+
+    def paint(self, painter, model, names=False, diagonals=False, flipIndicators=False):
+        tr = painter.transform()
+        sx = tr.m11()
+        sy = tr.m22()
+        font = painter.font()
+        fm = QFontMetrics(font)
+        opts = (names, diagonals, flipIndicators)
+
+        index = model.spatialIndex()
+        self._updateMargin(model, index, font, fm, names, flipIndicators)
+
+        key = (model, sx, sy, opts, font.key())
+        if key != self._key:
+            self._tiles.clear()
+            self._key = key
+            self._revision = None
+
+        if index.revision() != self._revision:
+            dirty = None if self._revision is None else index.dirtySince(self._revision)
+            if dirty is None or len(dirty) > self.maxDroppedSprites:
+                self._tiles.clear()
+            else:
+                for rect in dirty:
+                    self._dropTilesAround(*rect, sx, sy)
+            self._revision = index.revision()
+            if dirty is None:
+                self._selection = model.selection()
+
+        selection = model.selection()
+        if selection is not self._selection:
+            # Only the tiles around the sprites which were (de)selected need to change
+            changed = selection ^ self._selection
+            if len(changed) > self.maxDroppedSprites:
+                self._tiles.clear()
+            else:
+                store = model.sprites()
+                for slot in changed:
+                    self._dropTilesAround(*store.geometry(slot), sx, sy)
+            self._selection = selection
+
+        # NOTE: the rects of the clip region, the bounding rect of e.g. a crosshair is the
+        # whole widget
+        if painter.hasClipping():
+            clip = painter.clipRegion().rects()
+            # NOTE: the region is in image pixels, pad for the rounding of it's edges
+            exposed = [tr.mapRect(QRectF(r)).toAlignedRect().adjusted(-1, -1, 1, 1) for r in clip]
+        else:
+            clip = None
+            exposed = [QRect(0, 0, painter.device().width(), painter.device().height())]
+
+        ts = self.tileSize
+        tiles = set()
+        for r in exposed:
+            tiles.update((tx, ty) for ty in range(r.top() // ts, r.bottom() // ts + 1)
+                         for tx in range(r.left() // ts, r.right() // ts + 1))
+
+        painter.save()
+        painter.resetTransform()
+        for tx, ty in sorted(tiles):
+            tile = self._tiles.get((tx, ty))
+            if tile is None:
+                tile = self._renderTile(model, tx, ty, sx, sy, font, fm, opts)
+                self._tiles[(tx, ty)] = tile
+                if len(self._tiles) > self.maxTiles:
+                    self._tiles.popitem(last=False)
+            else:
+                self._tiles.move_to_end((tx, ty))
+            painter.drawPixmap(tx * ts, ty * ts, tile)
+        painter.restore()
+
+        if selection:
+            painter.setPen(self.selectedPen)
+            for spr in self._selectedSprites(model, selection, clip):
+                self.drawSprite(painter, spr, fm, *opts)
+
+    def drawSprite(self, painter, spr, fm, names, diagonals, flipIndicators):
+        x = spr.x()
+        y = spr.y()
+        w = spr.width()
+        h = spr.height()
+
+        painter.drawRect(x, y, w, h)
+
+        if diagonals:
+            painter.drawLine(x, y, x + w, y + h)
+            painter.drawLine(x + w, y, x, y + h)
+
+        if names:
+            text_width = fm.width(spr.name())
+            painter.drawText(x + w/2 - text_width/2, y + h/2, spr.name())
+
+        if flipIndicators:
+            drewX = False
+            th = fm.height()
+            if spr.isFlippedX():
+                painter.drawText(x, y + th, "X flipped")
+                drewX = True
+            if spr.isFlippedY():
+                offset = th
+                if drewX:
+                    offset *= 2
+                painter.drawText(x, y + offset, "Y flipped")
+
+    def _updateMargin(self, model, index, font, fm, names, flipIndicators):
+        """
+        Computes the text margin again when the sheet changed in a way that can change
+        it, only once per revision of the sheet and not for zooming or scrolling.
+        """
+        marginKey = (model, names, flipIndicators, font.key())
+        revision = index.revision()
+        if marginKey == self._marginKey:
+            if revision == self._marginRevision:
+                return
+            # NOTE: renames and new sprites can change how far names reach, moves can't
+            dirty = index.dirtySince(self._marginRevision)
+            if dirty is not None and len(model.sprites()) == self._count:
+                self._marginRevision = revision
+                return
+
+        self._margin = self._textMargin(model, fm, names, flipIndicators)
+        self._count = len(model.sprites())
+        self._marginKey = marginKey
+        self._marginRevision = revision
+
+    def _textMargin(self, model, fm, names, flipIndicators):
+        """
+        How far (in image pixels) text can reach outside of the sprite it belongs to,
+        so tiles also pick up the labels of sprites just outside of them.
+        """
+        mx = 1
+        my = 1
+        if names and len(model.sprites()):
+            longest = max(len(n) for n in model.sprites().names())
+            mx = max(mx, fm.maxWidth() * longest / 2)
+            my = max(my, fm.height())
+        if flipIndicators:
+            mx = max(mx, fm.width("Y flipped"))
+            my = max(my, fm.height() * 3)
+        return (mx, my)
+
+    def _renderTile(self, model, tx, ty, sx, sy, font, fm, opts):
+        ts = self.tileSize
+        tile = QPixmap(ts, ts)
+        tile.fill(Qt.transparent)
+
+        x0 = tx * ts / sx
+        y0 = ty * ts / sy
+        mx, my = self._margin
+        area = QRect(math.floor(x0 - mx), math.floor(y0 - my),
+                     math.ceil(ts / sx + 2 * mx) + 1, math.ceil(ts / sy + 2 * my) + 1)
+
+        painter = QPainter(tile)
+        painter.setFont(font)
+        painter.scale(sx, sy)
+        painter.translate(-x0, -y0)
+        painter.setPen(self.outlinePen)
+
+        for spr in model.spritesInRect(area):
+            if spr.slot() in self._selection:
+                continue
+            self.drawSprite(painter, spr, fm, *opts)
+
+        painter.end()
+        return tile
+
+    def _selectedSprites(self, model, selection, clip):
+        if clip is None or len(selection) <= self.maxDroppedSprites:
+            store = model.sprites()
+            return [store.view(slot) for slot in selection if store.isLive(slot)]
+
+        mx, my = self._margin
+        found = {}
+        for r in clip:
+            area = QRectF(r).adjusted(-mx, -my, mx, my).toAlignedRect()
+            for spr in model.spritesInRect(area):
+                if spr.slot() in selection:
+                    found[spr.slot()] = spr
+        return list(found.values())
+
+    def margin(self):
+        """ How far (in image pixels) the drawing of a sprite can reach outside of it. """
+        return self._margin
+
+    def _dropTilesAround(self, x, y, w, h, sx, sy):
+        if not self._tiles:
+            return
+
+        ts = self.tileSize
+        mx, my = self._margin
+        x0 = math.floor((x - mx) * sx) // ts
+        y0 = math.floor((y - my) * sy) // ts
+        x1 = math.ceil((x + w + mx) * sx) // ts
+        y1 = math.ceil((y + h + my) * sy) // ts
+
+        for ty in range(y0, y1 + 1):
+            for tx in range(x0, x1 + 1):
+                self._tiles.pop((tx, ty), None)
@@ -0,0 +1,365 @@
+"""
+Fast path for finding and parsing @spritesheet blocks without tokenizing the whole stylesheet.
+
+The scanner jumps between the few characters which can change the structure of a
+stylesheet (brackets, strings, comments, semicolons and at-keywords), so ordinary
+rules are skipped at regex speed. Only the bodies of @spritesheet blocks are split
+into declarations, and only the simple forms generated by this tool and others
+are handled. Anything else raises ScanError, after which the caller should fall
+back to tinycss, either for the single block or for the whole file.
+
+Line and column numbers follow tinycss, so the results can be used interchangeably.
+"""
+import hashlib
+import re
+
+from tinycss.parsing import strip_whitespace
+from tinycss.tokenizer import tokenize_flat
+
+
+class ScanError(ValueError):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+_INTERESTING = re.compile(r"/\*|url\(|[\"'{}()\[\];@\\]", re.I)
+_COMMENT = re.compile(r"/\*[^*]*\*+(?:[^/*][^*]*\*+)*/")
+_STRING = re.compile(r"\"(?:[^\n\"\\]|\\.)*\"|'(?:[^\n'\\]|\\.)*'", re.S)
+_URI = re.compile(r"url\([ \t\n]*(?:\"(?:[^\n\"\\]|\\.)*\"|'(?:[^\n'\\]|\\.)*'"
+                  r"|(?:[!#$%&*-\[\]-~]|[^\x00-\x9f]|\\.)*)[ \t\n]*\)", re.I | re.S)
+_ATKEYWORD = re.compile(r"@-?(?:[_a-z]|[^\x00-\x9f]|\\)", re.I)
+_SPRITESHEET = re.compile(r"@spritesheet(?![_a-z0-9\-\\]|[^\x00-\x9f])", re.I)
+_IDENT_CHAR = re.compile(r"[_a-z0-9\-\\#@]|[^\x00-\x9f]", re.I)
+
+_IDENT = re.compile(r"-?[_a-zA-Z][_a-zA-Z0-9-]*\Z")
+_NUMBER = re.compile(r"([+-]?(?:[0-9]*\.[0-9]+|[0-9]+))(?:-?[_a-zA-Z][_a-zA-Z0-9-]*|%)?\Z")
+# A whole "name: x y w h;" declaration, which is what nearly every line of a spritesheet looks like
+_SPRITE_DECL = re.compile(r"[ \t\n]*(-?[_a-zA-Z][_a-zA-Z0-9-]*)[ \t\n]*:[ \t\n]*"
+                          + r"[ \t\n]+".join([r"([+-]?(?:[0-9]*\.[0-9]+|[0-9]+))(?:-?[_a-zA-Z][_a-zA-Z0-9-]*|%)?"] * 4)
+                          + r"[ \t\n]*(?:;|(?=[ \t\n]*\Z))")
+# Any other declaration without strings, comments or brackets, such as "src: sheet.png;"
+_OTHER_DECL = re.compile(r"[ \t\n]*(-?[_a-zA-Z][_a-zA-Z0-9-]*)[ \t\n]*:"
+                         r"((?:[^;\"'\\/(){}\[\]@!]|/(?!\*))*)(?:;|\Z)")
+# Whitespace and comments between declarations, like the "/* Path: ... */" comment written by Spritesheet
+_DECL_GAP = re.compile(r"[ \t\n]*(?:/\*[^*]*\*+(?:[^/*][^*]*\*+)*/[ \t\n]*)*")
+_BODY_TOKEN = re.compile(r"""
+      (?P<comment>/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)
+    | (?P<ws>[ \t\n]+)
+    | (?P<string>"[^\n"\\]*"|'[^\n'\\]*')
+    | (?P<punct>[;:])
+    | (?P<word>(?:[^ \t\n;:"'/\\(){}\[\]@!]|/(?!\*))+)
+""", re.X)
+_WS = " \t\n"
+
+
+class SpritesheetBlock:
+    """
+    Location of a single @spritesheet rule in the source text.
+    line, column and endline use the same (1-based) numbering as SpritesheetRule,
+    endline is None if the block ends in a way the scanner doesn't handle.
+    """
+    def __init__(self, text, start, end, head, bodyStart, bodyEnd, line, column, endline):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.head = head
+        self.bodyStart = bodyStart
+        self.bodyEnd = bodyEnd
+        self.line = line
+        self.column = column
+        self.endline = endline
+
+    def source(self):
+        return self.text[self.start:self.end]
+
+    def body(self):
+        return self.text[self.bodyStart:self.bodyEnd]
+
+    def digest(self):
+        return blockDigest(self.source())
+
+    def __repr__(self):
+        return f"<SpritesheetBlock {self.line}:{self.column}-{self.endline}>"
+
+
+def blockDigest(source):
+    """
+    Digest of the source of a @spritesheet block, from the at-keyword to the closing brace,
+    for telling which blocks of a stylesheet have changed.
+    """
+    return hashlib.sha1(source.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class BlockDigestWriter:
+    """
+    Passes text through to a file object while computing the blockDigest() of it,
+    so a block can be hashed while it's being written. A newline at the very end is
+    written but not hashed, as the block ends at the closing brace.
+    """
+    def __init__(self, fd):
+        self._fd = fd
+        self._hash = hashlib.sha1()
+        self._pendingNewline = False
+
+    def write(self, text):
+        if not text:
+            return 0
+        if self._pendingNewline:
+            self._hash.update(b"\n")
+        self._pendingNewline = text.endswith("\n")
+        self._hash.update((text[:-1] if self._pendingNewline else text).encode("utf-8", "surrogatepass"))
+        return self._fd.write(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def digest(self):
+        return self._hash.hexdigest()
+
+
+def _gapHasContent(text, start, end):
+    gap = text[start:end]
+    if "<!--" in gap or "-->" in gap:
+        gap = gap.replace("<!--", "").replace("-->", "")
+    return gap.strip(_WS) != ""
+
+
+def locateSpritesheets(text):
+    """
+    Finds all top-level @spritesheet blocks in the stylesheet text.
+    Raises ScanError if the structure of the stylesheet is too unusual to be
+    sure the result matches tinycss.
+    """
+    if "\r" in text or "\f" in text:
+        # tinycss counts these as newlines, which Python's line iteration doesn't agree on
+        raise ScanError("unsupported newline characters")
+
+    blocks = []
+    stack = []
+    # True while only whitespace has been seen since the last top-level rule ended
+    ruleStart = True
+    inAtRule = False
+    block = None
+
+    lineCountPos = 0
+    line = 1
+
+    pos = 0
+    length = len(text)
+    while pos < length:
+        m = _INTERESTING.search(text, pos)
+        end = m.start() if m else length
+
+        if ruleStart and not stack and _gapHasContent(text, pos, end):
+            ruleStart = False
+
+        if not m:
+            break
+
+        i = m.start()
+        tok = m.group()
+
+        if tok == "/*":
+            cm = _COMMENT.match(text, i)
+            if not cm:
+                raise ScanError("unterminated comment")
+            pos = cm.end()
+            continue
+
+        if not stack:
+            ruleStart = ruleStart and tok in "@{}"
+
+        if tok in "\"'":
+            sm = _STRING.match(text, i)
+            if not sm:
+                raise ScanError(f"unterminated string at offset {i}")
+            pos = sm.end()
+        elif tok == "\\":
+            # Escaped character, can't open or close anything
+            pos = i + 2
+        elif len(tok) == 4:
+            # url( is a single token if it starts a token, otherwise it's a function
+            if i > 0 and _IDENT_CHAR.match(text, i - 1):
+                stack.append(")")
+                pos = i + 4
+            else:
+                um = _URI.match(text, i)
+                if not um:
+                    raise ScanError(f"unsupported url() at offset {i}")
+                pos = um.end()
+        elif tok == "@":
+            if not stack and ruleStart:
+                ruleStart = False
+                inAtRule = _ATKEYWORD.match(text, i) is not None
+                sm = _SPRITESHEET.match(text, i)
+                if sm:
+                    line += text.count("\n", lineCountPos, i)
+                    lineCountPos = i
+                    column = i - (text.rfind("\n", 0, i) + 1) + 1
+                    block = [i, sm.end(), line, column]
+            pos = i + 1
+        elif tok == ";":
+            if not stack and inAtRule:
+                if block:
+                    raise ScanError("@spritesheet without a block")
+                inAtRule = False
+                ruleStart = True
+            pos = i + 1
+        elif tok in "([{":
+            if tok == "{" and not stack and block and len(block) == 4:
+                block.append(i)
+            stack.append({"(": ")", "[": "]", "{": "}"}[tok])
+            pos = i + 1
+        else:
+            if stack and stack[-1] == tok:
+                stack.pop()
+                if not stack and tok == "}":
+                    inAtRule = False
+                    ruleStart = True
+                    if block:
+                        blocks.append(_finishBlock(text, block, i))
+                        block = None
+            elif not stack:
+                raise ScanError(f"unmatched {tok} at offset {i}")
+            pos = i + 1
+
+    if stack or block:
+        raise ScanError("unexpected end of stylesheet")
+
+    return blocks
+
+
+def _finishBlock(text, block, closePos):
+    start, headStart, line, column, openPos = block
+    bodyStart = openPos + 1
+    body = text[bodyStart:closePos]
+
+    # The end line is the line of the closing brace (see RCSSParser.parse_at_rule), it's
+    # left as None for the blocks where tinycss would give a different line
+    endline = None
+    if body.rstrip(_WS) and not body.rstrip(_WS).endswith("*/"):
+        endline = line + text.count("\n", start, closePos)
+
+    return SpritesheetBlock(text, start, closePos + 1, text[headStart:openPos],
+                            bodyStart, closePos, line, column, endline)
+
+
+def parseName(head):
+    """ Returns the spritesheet name from the block head, as RCSSParser.parse_spritesheet_name. """
+    if "\\" in head or re.search(r"[^\x00-\x7f]", head):
+        raise ScanError("unsupported characters in @spritesheet name")
+
+    head = _COMMENT.sub(" ", head).strip(_WS)
+    if _IDENT.match(head):
+        return head
+    return "UNNAMED"
+
+
+def _valueText(value):
+    """ Concatenated token values, the same as tinycss gives for reserved props. """
+    tokens = strip_whitespace(tokenize_flat(value))
+    return "".join(str(t.value) for t in tokens)
+
+
+def parseDeclarations(body, reservedProps):
+    """
+    Splits the block body into declarations. Returns a list of (name, text, values)
+    tuples, where reserved props have their value as text and sprites have a list
+    of numeric values.
+    """
+    decls = []
+    pos = 0
+    while True:
+        pos = _DECL_GAP.match(body, pos).end()
+        m = _SPRITE_DECL.match(body, pos)
+        if m and m.group(1).lower() not in reservedProps:
+            values = [float(v) if "." in v else int(v) for v in m.group(2, 3, 4, 5)]
+            decls.append((m.group(1).lower(), None, values))
+            pos = m.end()
+            continue
+
+        m = _OTHER_DECL.match(body, pos)
+        if not m:
+            break
+        name = m.group(1).lower()
+        if name in reservedProps and m.group(2).strip(_WS):
+            decls.append((name, _valueText(m.group(2)), None))
+        else:
+            decls.extend(_tokenizeDeclarations(m.group(), reservedProps))
+        pos = m.end()
+
+    if body[pos:].strip(_WS):
+        decls.extend(_tokenizeDeclarations(body[pos:], reservedProps))
+    return decls
+
+
+def _tokenizeDeclarations(body, reservedProps):
+    """ Slower path of parseDeclarations for anything but the simple sprite declarations. """
+    tokens = []
+    pos = 0
+    for m in _BODY_TOKEN.finditer(body):
+        if m.start() != pos:
+            break
+        tokens.append((m.lastgroup, m.start(), m.end()))
+        pos = m.end()
+    if pos != len(body):
+        raise ScanError(f"unsupported content in @spritesheet block at offset {pos}")
+
+    decls = []
+    part = []
+    # NOTE: the trailing None flushes the last declaration, which may lack a semicolon
+    for tok in tokens + [None]:
+        if tok is not None and (tok[0] != "punct" or body[tok[1]:tok[2]] != ";"):
+            part.append(tok)
+            continue
+
+        part = [t for t in part if t[0] != "comment"]
+        while part and part[0][0] == "ws":
+            part.pop(0)
+        while part and part[-1][0] == "ws":
+            part.pop()
+        if part:
+            decls.append(_parseDeclaration(body, part, reservedProps))
+        part = []
+
+    return decls
+
+
+def _parseDeclaration(body, part, reservedProps):
+    kind, start, end = part[0]
+    name = body[start:end]
+    if kind != "word" or not _IDENT.match(name):
+        raise ScanError(f"unsupported declaration name {name!r}")
+
+    i = 1
+    while i < len(part) and part[i][0] == "ws":
+        i += 1
+    if i >= len(part) or body[part[i][1]:part[i][2]] != ":":
+        raise ScanError(f"expected ':' after {name!r}")
+
+    value = part[i+1:]
+    while value and value[0][0] == "ws":
+        value.pop(0)
+    if not value:
+        raise ScanError(f"missing value for {name!r}")
+
+    # NOTE: property names are case-insensitive, tinycss lower-cases them
+    name = name.lower()
+
+    if name in reservedProps:
+        return (name, _valueText(body[value[0][1]:value[-1][2]]), None)
+
+    values = []
+    for kind, start, end in value:
+        if kind == "ws":
+            continue
+        if kind != "word":
+            raise ScanError(f"unsupported value for {name!r}")
+        nm = _NUMBER.match(body, start, end)
+        if not nm:
+            raise ScanError(f"unsupported value for {name!r}")
+        num = nm.group(1)
+        values.append(float(num) if "." in num else int(num))
+
+    return (name, None, values)
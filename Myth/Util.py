@@ -1,5 +1,10 @@
+import collections
 import functools
 import hashlib
+import io
+import os
+import shutil
+import tempfile
 
 from PySide2.QtGui import QImageReader, QImageWriter
 
@@ -13,6 +18,9 @@ except Exception:
 VERSION = "1.0.1"
 
 
+def checksumData(data):
+    return hashlib.sha1(data).hexdigest()
+
 def checksumFile(filename, chunkSize=32*1024):
     sum = hashlib.sha1()
     with open(filename, "rb") as fd:
@@ -24,6 +32,17 @@ def checksumFile(filename, chunkSize=32*1024):
             sum.update(d)
     return sum.hexdigest()
 
+def fileFingerprint(filename):
+    """
+    Cheap stand-in for the file contents: (mtime, size, inode), or None if the file
+    can't be stat'd. If this hasn't changed then the contents almost certainly haven't.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
 def supportedImageFormats(fmts, aggregate):
     ret = None
     if aggregate:
@@ -58,3 +77,153 @@ def supportedImageFormatToExt(longFmt):
     if fmt == "all":
         return None
     return fmt.lower()
+
+class FrameTimer:
+    """
+    Keeps the durations of the last few frames, for checking how expensive painting is.
+    """
+    def __init__(self, size=120):
+        self._times = collections.deque(maxlen=size)
+        self._frames = 0
+
+    def add(self, seconds):
+        self._times.append(seconds)
+        self._frames += 1
+
+    def frames(self):
+        return self._frames
+
+    def last(self):
+        return self._times[-1] if self._times else 0.0
+
+    def average(self):
+        if not self._times:
+            return 0.0
+        return sum(self._times) / len(self._times)
+
+    def worst(self):
+        return max(self._times, default=0.0)
+
+    def reset(self):
+        self._times.clear()
+        self._frames = 0
+
+
+class _HashingWriter(io.RawIOBase):
+    """ Passes writes through to a binary file while hashing them. """
+    def __init__(self, fd):
+        self._fd = fd
+        self.hash = hashlib.sha1()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # NOTE: the file is unbuffered, so a write can be partial. The BufferedWriter
+        # on top of this writes the rest again, only hash what actually got written.
+        n = self._fd.write(data)
+        self.hash.update(memoryview(data)[:n])
+        return n
+
+class AtomicFileWriter:
+    """
+    Context manager for writing a text file through a temporary file in the same
+    directory, which is renamed over the target only once everything has been
+    written. A crash in the middle of writing leaves the original file untouched.
+
+    The written data is hashed on the way, digest() gives the same value as
+    checksumFile() would for the new file. With fsync the data (and the rename)
+    is flushed to disk before returning, and with backup the previous version of
+    the file is kept as <filename>.bak, hardlinked if possible instead of copied.
+    """
+    def __init__(self, filename, fsync=True, backup=False):
+        self.filename = filename
+        self.fsync = fsync
+        self.backup = backup
+        self._digest = None
+
+    def __enter__(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, self._tmpName = tempfile.mkstemp(dir=directory, suffix=".tmp",
+                                             prefix=f".{os.path.basename(self.filename)}.")
+        # NOTE: unbuffered, so flushing the wrapper leaves nothing in Python's buffers
+        # and the fsync covers all of the data
+        self._raw = os.fdopen(fd, "wb", buffering=0)
+        self._hashing = _HashingWriter(self._raw)
+        self.file = io.TextIOWrapper(io.BufferedWriter(self._hashing))
+        return self.file
+
+    def __exit__(self, excType, exc, tb):
+        ok = excType is None
+        try:
+            if ok:
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self._raw.fileno())
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            # NOTE: closing the wrapper doesn't close the real file, only the hashing writer
+            try:
+                self.file.close()
+            except OSError:
+                if ok:
+                    raise
+            finally:
+                self._raw.close()
+                if not ok:
+                    os.remove(self._tmpName)
+
+        if not ok:
+            return False
+
+        try:
+            if os.path.exists(self.filename):
+                shutil.copymode(self.filename, self._tmpName)
+                if self.backup:
+                    self._backup()
+            else:
+                os.chmod(self._tmpName, 0o666 & ~_umask())
+
+            os.replace(self._tmpName, self.filename)
+        except BaseException:
+            os.remove(self._tmpName)
+            raise
+
+        if self.fsync:
+            _fsyncDirectory(os.path.dirname(os.path.abspath(self.filename)))
+
+        self._digest = self._hashing.hash.hexdigest()
+        return False
+
+    def digest(self):
+        return self._digest
+
+    def _backup(self):
+        backupName = self.filename + ".bak"
+        if os.path.exists(backupName):
+            os.remove(backupName)
+        try:
+            # The original is about to be replaced, so it can just keep living under the new name
+            os.link(self.filename, backupName)
+        except OSError:
+            shutil.copy2(self.filename, backupName)
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+def _fsyncDirectory(directory):
+    # NOTE: not possible on every platform (e.g. Windows), the rename is still atomic there
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
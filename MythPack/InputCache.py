@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from PySide2.QtCore import *
+from PySide2.QtGui import *
+
+from Myth.ImageCache import ImageCache
+
+
+InputInfo = namedtuple("InputInfo", ["width", "height"])
+
+
+class InputCache:
+    """
+    Cache of the packer's input images.
+
+    The size of each file is kept in a JSON file in directory, keyed by the
+    resolved path together with the file's mtime and size, so only files which
+    changed have their header read again. Decoded images are kept in memory in
+    an ImageCache under the same key.
+
+    A directory of None keeps everything in memory only, an imageBudget of 0
+    doesn't keep decoded images at all.
+    """
+    # NOTE: bump this whenever the stored data changes
+    formatVersion = 2
+
+    def __init__(self, directory=None, maxEntries=65536, imageBudget=0):
+        self._directory = directory
+        self._maxEntries = maxEntries
+        self._images = ImageCache(imageBudget)
+        # resolved path -> [mtime_ns, size, width, height], least recently used first
+        self._entries = None
+        self._dirty = False
+        # NOTE: info() and decode() are called from the packer's worker threads
+        self._lock = threading.Lock()
+
+    def directory(self):
+        return self._directory
+
+    def images(self):
+        return self._images
+
+    def _path(self):
+        return os.path.join(self._directory, "inputs.json")
+
+    def _load(self):
+        self._entries = OrderedDict()
+        if not self._directory:
+            return
+
+        try:
+            with open(self._path(), "r", encoding="utf-8") as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return
+
+        if not isinstance(data, dict) or data.get("version") != self.formatVersion:
+            return
+
+        try:
+            for path, entry in data["entries"]:
+                mtime, size, w, h = entry
+                self._entries[path] = [mtime, size, w, h]
+        except (KeyError, TypeError, ValueError):
+            self._entries = OrderedDict()
+
+    def _lookup(self, key):
+        if self._entries is None:
+            self._load()
+
+        entry = self._entries.get(key[0])
+        if entry is None or entry[0] != key[1] or entry[1] != key[2]:
+            return None
+
+        self._entries.move_to_end(key[0])
+        return entry
+
+    def info(self, filename):
+        """
+        Returns the InputInfo of an image file. Raises OSError if the file can't be
+        read and ValueError if it's not an image.
+        """
+        key = ImageCache.keyFor(filename)
+        if key is None:
+            raise OSError(f"Cannot open {filename}")
+
+        with self._lock:
+            entry = self._lookup(key)
+        if entry:
+            return InputInfo(entry[2], entry[3])
+
+        # Only the header is needed for the size, the pixels are decoded when the
+        # image is composited
+        reader = QImageReader(filename)
+        qsize = reader.size()
+        if qsize.isValid():
+            w, h = qsize.width(), qsize.height()
+        else:
+            # NOTE: some formats can't tell their size without decoding, keep the
+            # image so it isn't decoded again for compositing
+            img = reader.read()
+            if img.isNull():
+                raise ValueError(f"Cannot identify image file {filename}: {reader.errorString()}")
+            w, h = img.width(), img.height()
+            with self._lock:
+                self._images.put(key, img)
+
+        with self._lock:
+            self._entries[key[0]] = [key[1], key[2], w, h]
+            self._dirty = True
+        return InputInfo(w, h)
+
+    def decode(self, filename):
+        """ Returns the decoded image of a file, from memory if it's there. """
+        key = ImageCache.keyFor(filename)
+        with self._lock:
+            img = self._images.get(key)
+        if img is not None:
+            return img
+
+        reader = QImageReader(filename)
+        img = reader.read()
+        if img.isNull():
+            raise OSError(f"Cannot read image file {filename}: {reader.errorString()}")
+        with self._lock:
+            self._images.put(key, img)
+        return img
+
+    # NOTE: the QPILImage source interface
+    def size(self, filename):
+        info = self.info(filename)
+        return info.width, info.height
+
+    def save(self):
+        """ Writes the metadata to disk if it changed. Returns an error message if it couldn't. """
+        if not self._directory or not self._dirty:
+            return None
+
+        with self._lock:
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last=False)
+            data = {
+                "version": self.formatVersion,
+                "entries": list(self._entries.items()),
+            }
+            self._dirty = False
+
+        path = self._path()
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fd:
+                json.dump(data, fd, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError as e:
+            return f"Could not write packer cache {path}: {e}"
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._dirty = True
+            self._images.clear()
+        return self.save()
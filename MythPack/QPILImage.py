@@ -19,21 +19,42 @@ except KeyError:
 
 sys.modules["PIL"] = sys.modules[__name__]
 
+# Where opened images get their size and pixels from, see setSource()
+_source = None
+
+
+def setSource(source):
+    """
+    Makes Image.open() go through source, an object with size(filename) and
+    decode(filename) methods like MythPack.InputCache. None reads the files directly.
+    """
+    global _source
+    _source = source
+
 
 class Image:
     """
     Implements a minimal subset of PIL.Image used by PyTexturePacker.
+
+    Opened images only read the header for their size. The pixels are decoded
+    each time they're needed and not kept, so only the atlas being composited
+    stays in memory. Pasting into an opened image decodes it for good.
     """
 
     ROTATE_270 = 1
 
-    def __init__(self, image):
+    def __init__(self, image, path=None, size=None, source=None):
         self._img = image
+        self._path = path
+        self._size = size
+        self._source = source
 
     def close(self):
         pass
 
     def copy(self):
+        if self._img is None:
+            return Image(None, self._path, self._size, self._source)
         return Image(self._img.copy())
 
     def transpose(self, method):
@@ -46,6 +67,10 @@ class Image:
         raise RuntimeError("Bbox crop unimplemented")
 
     def paste(self, image, rect):
+        if self._img is None:
+            self._img = self._decode()
+            self._path = None
+
         painter = QPainter(self._img)
 
         # NOTE from Pillow docs: If a 4-tuple is given, the size of the pasted image
@@ -55,16 +80,42 @@ class Image:
         painter.end()
 
     def getQImage(self):
+        if self._img is None:
+            return self._decode()
         return self._img
 
+    def _decode(self):
+        if self._source:
+            return self._source.decode(self._path)
+
+        reader = QImageReader(self._path)
+        img = reader.read()
+        if img.isNull():
+            raise IOError(f"Cannot read image file {self._path}: {reader.errorString()}")
+        return img
+
     @property
     def size(self):
+        if self._img is None:
+            return self._size
         qsize = self._img.size()
         return (qsize.width(), qsize.height())
 
     @staticmethod
     def open(filename):
-        return Image(QImage(filename))
+        if _source:
+            return Image(None, filename, _source.size(filename), _source)
+
+        reader = QImageReader(filename)
+        qsize = reader.size()
+        if qsize.isValid():
+            return Image(None, filename, (qsize.width(), qsize.height()))
+
+        # NOTE: some formats can't tell their size without decoding
+        img = reader.read()
+        if img.isNull():
+            raise IOError(f"Cannot identify image file {filename}: {reader.errorString()}")
+        return Image(img)
 
     @staticmethod
     def pilColorToQt(col):
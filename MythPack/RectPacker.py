@@ -0,0 +1,441 @@
+import bisect
+import math
+from array import array
+
+SKYLINE = "Skyline"
+MAXRECTS = "MaxRects"
+GUILLOTINE = "Guillotine"
+
+METHODS = [SKYLINE, MAXRECTS, GUILLOTINE]
+
+
+def packRects(widths, heights, binWidth, binHeight, method=SKYLINE):
+    """
+    Places rectangles into a binWidth x binHeight bin without overlap.
+
+    widths and heights are int sequences, the positions are returned as two
+    array("i") of the same length with -1 for the rectangles which didn't fit.
+    The result only depends on the input, so packing again gives the same layout.
+    """
+    n = len(widths)
+    xs = array("i", [-1]) * n
+    ys = array("i", [-1]) * n
+
+    if method == SKYLINE:
+        # Tallest first keeps the skyline flat
+        order = sorted(range(n), key=lambda i: (-heights[i], -widths[i], i))
+        _skyline(widths, heights, binWidth, binHeight, order, xs, ys)
+    elif method == MAXRECTS:
+        order = sorted(range(n), key=lambda i: (-max(widths[i], heights[i]), -min(widths[i], heights[i]), i))
+        _maxRects(widths, heights, binWidth, binHeight, order, xs, ys)
+    elif method == GUILLOTINE:
+        order = sorted(range(n), key=lambda i: (-widths[i] * heights[i], i))
+        _guillotine(widths, heights, binWidth, binHeight, order, xs, ys)
+    else:
+        raise ValueError(f"Unknown packing method {method}")
+
+    return xs, ys
+
+
+def packAtlas(widths, heights, maxWidth, maxHeight, method=SKYLINE,
+              borderPadding=0, shapePadding=0, forceSquare=False):
+    """
+    Packs rectangles into the smallest atlas it can find within maxWidth x maxHeight.
+
+    borderPadding is kept free along the atlas edges and shapePadding between the
+    rectangles. Returns (xs, ys, width, height), xs and ys are -1 for the
+    rectangles which didn't fit into the largest atlas. The atlas is cropped to the
+    placed rectangles, and made square if forceSquare is set.
+    """
+    n = len(widths)
+    if forceSquare:
+        maxWidth = maxHeight = min(maxWidth, maxHeight)
+
+    # The rectangles carry the shape padding on their right and bottom, the bin
+    # has room for the padding of the last ones
+    pw = array("i", (w + shapePadding for w in widths))
+    ph = array("i", (h + shapePadding for h in heights))
+    innerMaxW = maxWidth - 2 * borderPadding + shapePadding
+    innerMaxH = maxHeight - 2 * borderPadding + shapePadding
+
+    if n == 0 or innerMaxW <= 0 or innerMaxH <= 0:
+        return array("i", [-1]) * n, array("i", [-1]) * n, 0, 0
+
+    # Start with an estimate from the total area and grow until everything fits.
+    # NOTE: rectangles wider or taller than the atlas can never fit, they don't
+    # count towards the size so they don't blow the atlas up to the maximum
+    fitting = [i for i in range(n) if pw[i] <= innerMaxW and ph[i] <= innerMaxH]
+    area = sum(pw[i] * ph[i] for i in fitting)
+    side = int(math.sqrt(area / 0.9)) + 1
+    binW = min(innerMaxW, max([side] + [pw[i] for i in fitting]))
+    binH = min(innerMaxH, max([side] + [ph[i] for i in fitting]))
+    if forceSquare:
+        binW = binH = max(binW, binH)
+
+    while True:
+        xs, ys = packRects(pw, ph, binW, binH, method)
+        if all(xs[i] >= 0 for i in fitting) or (binW == innerMaxW and binH == innerMaxH):
+            break
+
+        if forceSquare:
+            binW = binH = min(innerMaxW, binW + max(binW // 4, 1))
+        elif (binW <= binH or binH == innerMaxH) and binW < innerMaxW:
+            binW = min(innerMaxW, binW + max(binW // 4, 1))
+        else:
+            binH = min(innerMaxH, binH + max(binH // 4, 1))
+
+    width = 0
+    height = 0
+    for i in range(n):
+        if xs[i] < 0:
+            continue
+        xs[i] += borderPadding
+        ys[i] += borderPadding
+        width = max(width, xs[i] + widths[i])
+        height = max(height, ys[i] + heights[i])
+
+    if width:
+        width += borderPadding
+        height += borderPadding
+    if forceSquare:
+        width = height = max(width, height)
+
+    return xs, ys, width, height
+
+
+def packPages(widths, heights, maxWidth, maxHeight, method=SKYLINE,
+              borderPadding=0, shapePadding=0, forceSquare=False):
+    """
+    Packs rectangles into as many atlases as it takes, see packAtlas().
+
+    Returns (pages, unfit). pages is a list of (indices, xs, ys, width, height)
+    with the positions in the order of indices, unfit are the indices of the
+    rectangles which don't fit even an empty atlas.
+    """
+    remaining = list(range(len(widths)))
+    pages = []
+    while remaining:
+        xs, ys, width, height = packAtlas([widths[i] for i in remaining], [heights[i] for i in remaining],
+                                          maxWidth, maxHeight, method, borderPadding, shapePadding,
+                                          forceSquare)
+        placed = [k for k in range(len(remaining)) if xs[k] >= 0]
+        if not placed:
+            break
+
+        pages.append(([remaining[k] for k in placed], array("i", (xs[k] for k in placed)),
+                      array("i", (ys[k] for k in placed)), width, height))
+        remaining = [remaining[k] for k in range(len(remaining)) if xs[k] < 0]
+
+    return pages, remaining
+
+
+def _skyline(widths, heights, binWidth, binHeight, order, xs, ys):
+    """ Bottom-left skyline: each rectangle goes where it's top edge ends up lowest. """
+    # The skyline as segments, sorted by x and covering the bin's width
+    segX = [0]
+    segY = [0]
+    segW = [binWidth]
+
+    for r in order:
+        w = widths[r]
+        h = heights[r]
+        if w > binWidth or h > binHeight:
+            continue
+
+        bestTop = binHeight + 1
+        bestWidth = 0
+        bestI = -1
+        bestY = 0
+        count = len(segX)
+        for i in range(count):
+            x = segX[i]
+            if x + w > binWidth:
+                break
+            # NOTE: can't beat the best top if even the segment itself is too high
+            if segY[i] + h > bestTop:
+                continue
+
+            # The rectangle rests on the highest segment below it
+            y = 0
+            left = w
+            j = i
+            while left > 0:
+                sy = segY[j]
+                if sy > y:
+                    y = sy
+                    # NOTE: only stop early when it's strictly worse, on a tie
+                    # the full height is needed
+                    if y + h > bestTop:
+                        break
+                left -= segW[j]
+                j += 1
+
+            top = y + h
+            if top < bestTop or (top == bestTop and segW[i] < bestWidth):
+                if top <= binHeight:
+                    bestTop = top
+                    bestWidth = segW[i]
+                    bestI = i
+                    bestY = y
+
+        if bestI < 0:
+            continue
+
+        x = segX[bestI]
+        xs[r] = x
+        ys[r] = bestY
+
+        # Replace the covered segments with the top of the rectangle
+        end = x + w
+        j = bestI
+        while j < len(segX) and segX[j] < end:
+            j += 1
+        last = j - 1
+        lastEnd = segX[last] + segW[last]
+        if lastEnd > end:
+            # Keep the uncovered part of the last segment
+            segX[bestI:j] = [x, end]
+            segY[bestI:j] = [bestTop, segY[last]]
+            segW[bestI:j] = [w, lastEnd - end]
+        else:
+            segX[bestI:j] = [x]
+            segY[bestI:j] = [bestTop]
+            segW[bestI:j] = [w]
+
+        # Merge with the neighbours at the same height
+        if bestI + 1 < len(segX) and segY[bestI + 1] == bestTop:
+            segW[bestI] += segW[bestI + 1]
+            del segX[bestI + 1], segY[bestI + 1], segW[bestI + 1]
+        if bestI > 0 and segY[bestI - 1] == bestTop:
+            segW[bestI - 1] += segW[bestI]
+            del segX[bestI], segY[bestI], segW[bestI]
+
+
+class _FreeRects:
+    """
+    The free rectangles of MaxRects as (x, y, right, bottom), indexed so placing a
+    rectangle only looks at the ones that matter: by width and height for finding
+    the best fit, and in a coarse grid over the bin for the ones around it.
+    """
+    # NOTE: most free rectangles are long strips, a finer grid costs more to keep
+    # up to date than it saves on the lookups
+    divisions = 8
+
+    def __init__(self, binWidth, binHeight):
+        divisions = self.divisions
+        # width -> (height, y, x, rectangle) sorted, and the other way around for heights,
+        # with the sizes in use sorted
+        self.byWidth = {}
+        self.byHeight = {}
+        self.widths = []
+        self.heights = []
+        # divisions x divisions cells, each with the rectangles overlapping it
+        self.cellWidth = max(1, -(-binWidth // divisions))
+        self.cellHeight = max(1, -(-binHeight // divisions))
+        self.columns = -(-binWidth // self.cellWidth) + 1
+        self.grid = [set() for _ in range(self.columns * (-(-binHeight // self.cellHeight) + 1))]
+
+    def _cells(self, x, y, r, b):
+        cw = self.cellWidth
+        ch = self.cellHeight
+        columns = self.columns
+        x0 = max(x, 0) // cw
+        x1 = (r - 1) // cw + 1
+        return [row + cx
+                for row in range(max(y, 0) // ch * columns, ((b - 1) // ch + 1) * columns, columns)
+                for cx in range(x0, min(x1, columns))]
+
+    def add(self, f):
+        x, y, r, b = f
+        w = r - x
+        h = b - y
+        rects = self.byWidth.get(w)
+        if rects is None:
+            rects = self.byWidth[w] = []
+            bisect.insort(self.widths, w)
+        bisect.insort(rects, (h, y, x, f))
+        rects = self.byHeight.get(h)
+        if rects is None:
+            rects = self.byHeight[h] = []
+            bisect.insort(self.heights, h)
+        bisect.insort(rects, (w, y, x, f))
+
+        grid = self.grid
+        for cell in self._cells(x, y, r, b):
+            grid[cell].add(f)
+
+    def remove(self, f):
+        x, y, r, b = f
+        w = r - x
+        h = b - y
+        rects = self.byWidth[w]
+        del rects[bisect.bisect_left(rects, (h, y, x, f))]
+        if not rects:
+            del self.byWidth[w]
+            del self.widths[bisect.bisect_left(self.widths, w)]
+        rects = self.byHeight[h]
+        del rects[bisect.bisect_left(rects, (w, y, x, f))]
+        if not rects:
+            del self.byHeight[h]
+            del self.heights[bisect.bisect_left(self.heights, h)]
+
+        grid = self.grid
+        for cell in self._cells(x, y, r, b):
+            grid[cell].discard(f)
+
+    def bestFit(self, w, h):
+        """
+        The rectangle with the best short side fit for w x h, or None.
+
+        Walks the widths and heights in use upwards from w and h together, the
+        first leftover found on either side is the best short side. The rectangles
+        with that width (height) are sorted by height (width), so the one with the
+        best long side is found by bisecting instead of comparing them all.
+        """
+        widths = self.widths
+        heights = self.heights
+        iw = bisect.bisect_left(widths, w)
+        ih = bisect.bisect_left(heights, h)
+
+        # NOTE: a rectangle whose long side would be shorter than the short side has
+        # been found on the other side already
+        while iw < len(widths) or ih < len(heights):
+            dw = widths[iw] - w if iw < len(widths) else math.inf
+            dh = heights[ih] - h if ih < len(heights) else math.inf
+            short = dw if dw < dh else dh
+
+            bestKey = None
+            if dw == short:
+                rects = self.byWidth[widths[iw]]
+                i = bisect.bisect_left(rects, (h,))
+                if i < len(rects):
+                    fh, fy, fx, f = rects[i]
+                    bestKey = (fh - h, fy, fx, f)
+                iw += 1
+            if dh == short:
+                rects = self.byHeight[heights[ih]]
+                i = bisect.bisect_left(rects, (w,))
+                if i < len(rects):
+                    fw, fy, fx, f = rects[i]
+                    key = (fw - w, fy, fx, f)
+                    if bestKey is None or key < bestKey:
+                        bestKey = key
+                ih += 1
+
+            if bestKey is not None:
+                return bestKey[3]
+        return None
+
+    def near(self, x, y, r, b):
+        """ The rectangles overlapping or touching x, y, r, b. """
+        found = set()
+        grid = self.grid
+        for cell in self._cells(x - 1, y - 1, r + 1, b + 1):
+            found.update(grid[cell])
+        return [f for f in found if f[0] <= r and f[1] <= b and f[2] >= x and f[3] >= y]
+
+
+def _maxRects(widths, heights, binWidth, binHeight, order, xs, ys):
+    """ MaxRects with the best short side fit heuristic. """
+    # All maximal free rectangles, none contains another
+    free = _FreeRects(binWidth, binHeight)
+    free.add((0, 0, binWidth, binHeight))
+    # Free rectangles narrower or lower than this can't take any rectangle
+    minSide = min(min(widths), min(heights)) if order else 0
+
+    for r in order:
+        w = widths[r]
+        h = heights[r]
+
+        best = free.bestFit(w, h)
+        if best is None:
+            continue
+
+        px = best[0]
+        py = best[1]
+        pr = px + w
+        pb = py + h
+        xs[r] = px
+        ys[r] = py
+
+        # Split the free rectangles overlapping the placed one into the parts
+        # around it
+        pieces = []
+        touching = []
+        for f in free.near(px, py, pr, pb):
+            if f[0] >= pr or f[1] >= pb or f[2] <= px or f[3] <= py:
+                touching.append(f)
+                continue
+            free.remove(f)
+            fx, fy, fr, fb = f
+            if fb - fy >= minSide:
+                if px - fx >= minSide:
+                    pieces.append((fx, fy, px, fb))
+                if fr - pr >= minSide:
+                    pieces.append((pr, fy, fr, fb))
+            if fr - fx >= minSide:
+                if py - fy >= minSide:
+                    pieces.append((fx, fy, fr, py))
+                if fb - pb >= minSide:
+                    pieces.append((fx, pb, fr, fb))
+
+        # NOTE: a piece lies within a free rectangle which was split, so it can't
+        # contain any of the others. And it overlaps the placed rectangle's side, so
+        # only free rectangles touching the placed one can contain it.
+        for i, a in enumerate(pieces):
+            ax, ay, ar, ab = a
+            contained = False
+            for j, b in enumerate(pieces):
+                if i != j and b[0] <= ax and b[1] <= ay and ar <= b[2] and ab <= b[3]:
+                    # Of two identical pieces keep the first one
+                    if a != b or j < i:
+                        contained = True
+                        break
+            if not contained:
+                for b in touching:
+                    if b[0] <= ax and b[1] <= ay and ar <= b[2] and ab <= b[3]:
+                        contained = True
+                        break
+            if not contained:
+                free.add(a)
+
+
+def _guillotine(widths, heights, binWidth, binHeight, order, xs, ys):
+    """ Guillotine with best area fit, splitting along the shorter leftover axis. """
+    free = [(0, 0, binWidth, binHeight)]
+    # Free rectangles narrower or lower than this can't take any rectangle
+    minSide = min(min(widths), min(heights)) if order else 0
+
+    for r in order:
+        w = widths[r]
+        h = heights[r]
+
+        best = None
+        bestArea = binWidth * binHeight + 1
+        for f in [f for f in free if f[2] >= w and f[3] >= h]:
+            area = f[2] * f[3]
+            if area < bestArea:
+                best = f
+                bestArea = area
+                if area == w * h:
+                    break
+
+        if best is None:
+            continue
+
+        fx, fy, fw, fh = best
+        xs[r] = fx
+        ys[r] = fy
+
+        dw = fw - w
+        dh = fh - h
+        if dw <= dh:
+            # The leftover below spans the whole width
+            right = (fx + w, fy, dw, h)
+            below = (fx, fy + h, fw, dh)
+        else:
+            right = (fx + w, fy, dw, fh)
+            below = (fx, fy + h, w, dh)
+
+        i = free.index(best)
+        free[i:i + 1] = [f for f in (right, below) if f[2] >= minSide and f[3] >= minSide]
@@ -1,10 +1,25 @@
+import importlib.util
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-from Myth.Models.Sprite import Sprite
+from PySide2.QtCore import *
+from PySide2.QtGui import *
 
-import MythPack.QPILImage
-from PyTexturePacker import Packer
-from PyTexturePacker.ImageRect import ImageRect
+from Myth.Models.SpriteStore import SpriteStore
+
+from MythPack import RectPacker
+from MythPack.InputCache import InputCache
+
+# NOTE: PyTexturePacker is optional, the built-in packer is used without it.
+# The PIL shim has to be in place before PyTexturePacker is imported.
+if importlib.util.find_spec("PyTexturePacker"):
+    import MythPack.QPILImage
+    from PyTexturePacker import Packer
+    from PyTexturePacker.ImageRect import ImageRect
+else:
+    Packer = None
+
+PYTEXTUREPACKER = "PyTexturePacker"
 
 
 class PackerException(ValueError):
@@ -14,70 +29,202 @@ class PackerException(ValueError):
 
 class SpritePacker:
     """
-    I couldn't find a maintained Python texture packer that would give
-    it's output as anything but a file on disk.
-    So we're marionetting the guts of PyTexturePacker in this class :)
+    Packs a directory of images into one or more images.
 
-    This is a bit of a hack and could be broken by updates to PyTexturePacker,
-    as we're using "private" APIs here, but I don't feel like writing a new
-    texture packer for no particular gain.
+    The layout is done by MythPack.RectPacker. PyTexturePacker can still be used
+    if it's installed: I couldn't find a maintained Python texture packer that
+    would give it's output as anything but a file on disk, so for that we're
+    marionetting the guts of PyTexturePacker :) This is a bit of a hack and could
+    be broken by updates to PyTexturePacker, as we're using "private" APIs there.
     """
-    def __init__(self, spritePath, enterSubdirs=True):
-        print(f"Loading sprites from {spritePath}")
+    def __init__(self, spritePath, enterSubdirs=True, workers=None, progress=None, cache=None, error=None):
+        """
+        workers is the number of threads reading images, None for one per core.
+        progress is called as progress(done, total) while the images are read.
+        cache is an InputCache shared between packers, so packing the same files
+        again doesn't need to read them.
+        error is called as error(message) for each file which can't be read, those
+        are left out. The messages are also kept in errors().
+        """
         self._path = spritePath
-        self._images, self._errors = self.loadFromDir(spritePath, enterSubdirs)
+        self._workers = workers
+        self._cache = cache if cache is not None else InputCache()
+        self._files, self._errors = self.loadFromDir(spritePath, enterSubdirs, workers, progress, error)
 
-        if not len(self._images):
+        if not len(self._files):
             raise PackerException("Could not read any images from the path")
 
-    def images(self):
-        return self._images
+    def files(self):
+        """ (path, InputInfo) of the images, in packing order. """
+        return self._files
 
     def errors(self):
         return self._errors
 
-    def loadFromDir(self, spritePath, enterSubdirs):
-        images = []
-        errors = []
+    @staticmethod
+    def listFiles(spritePath, enterSubdirs):
+        """ Paths of the files in the directory, sorted so the packing is reproducible. """
+        paths = []
         for root, dirs, files in os.walk(spritePath):
-            for f in files:
-                fullpath = os.path.join(root, f)
+            # NOTE: os.walk descends in the order of dirs
+            dirs.sort()
+            paths.extend(os.path.join(root, f) for f in sorted(files))
 
-                print(f"Reading {fullpath}")
+            if not enterSubdirs:
+                break
+        return paths
 
-                try:
-                    images.append(ImageRect(fullpath))
-                except Exception as e:
-                    errors.append(str(e))
+    def _readInfo(self, path):
+        try:
+            return self._cache.info(path), None
+        except (OSError, ValueError) as e:
+            return None, f"{path}: {e}"
+
+    def loadFromDir(self, spritePath, enterSubdirs, workers=None, progress=None, error=None):
+        paths = self.listFiles(spritePath, enterSubdirs)
+        total = len(paths)
+        files = []
+        errors = []
 
-                if not enterSubdirs:
-                    break
-        return images, errors
+        if progress:
+            progress(0, total)
+
+        # NOTE: this only reads the image headers, the pixels are decoded one by one
+        # when they're composited into the atlas. Files the cache knows are only
+        # stat'd. QImageReader is reentrant and releases the GIL, so threads are
+        # enough. map gives the results in the order of the paths no matter which
+        # finishes first.
+        with ThreadPoolExecutor(max_workers=workers or None) as pool:
+            for done, (info, message) in enumerate(pool.map(self._readInfo, paths), 1):
+                if message:
+                    errors.append(message)
+                    if error:
+                        error(message)
+                else:
+                    files.append((paths[done - 1], info))
+
+                if progress:
+                    progress(done, total)
+
+        # NOTE: not being able to save the cache only makes the next run slower
+        message = self._cache.save()
+        if message:
+            errors.append(message)
+            if error:
+                error(message)
+        return files, errors
 
     def pathToId(self, path):
         return path.replace(os.sep, "-")
 
-    def pack(self, bg_color=0, **kwargs):
+    def spriteId(self, path):
+        # Slice off root folder and path separator
+        p = path[len(self._path)+1:]
+        p = os.path.splitext(p)[0]
+        return self.pathToId(p)
+
+    @staticmethod
+    def methods():
+        """ The packing methods which can be passed to pack(). """
+        if Packer:
+            return RectPacker.METHODS + [PYTEXTUREPACKER]
+        return list(RectPacker.METHODS)
+
+    @staticmethod
+    def colorToQt(col):
+        # RGBA to QColor
+        return QColor((col >> 24) & 0xFF, (col >> 16) & 0xFF, (col >> 8) & 0xFF, col & 0xFF)
+
+    def pack(self, bg_color=0, method=RectPacker.SKYLINE, **kwargs):
+        """
+        Packs the images into as many pages as it takes. Returns (pages, error)
+        where pages is a list of (image, sprites), and error is set if some of the
+        images couldn't be packed at all.
+
+        method is one of methods(). The options are named after PyTexturePacker's:
+        max_width, max_height, border_padding, shape_padding, inner_padding,
+        force_square and enable_rotated.
+        """
+        if method == PYTEXTUREPACKER:
+            return self._packPyTexturePacker(bg_color, **kwargs)
+        return self._packNative(bg_color, method, **kwargs)
+
+    def _packNative(self, bg_color, method, max_width=4096, max_height=4096, border_padding=2,
+                    shape_padding=2, inner_padding=0, force_square=False, enable_rotated=False):
+        # NOTE: enable_rotated is ignored, RCSS can't rotate sprites anyway
+        files = self._files
+        pad = inner_padding * 2
+        widths = [info.width + pad for _, info in files]
+        heights = [info.height + pad for _, info in files]
+
         try:
-            packer = Packer.create(**kwargs)
-            # TODO: why is this an array??
-            atlas = packer._pack(self._images)[0]
-            packed = atlas.dump_image(bg_color)
-            rmlSprites = []
-            error = None
+            pages, unfit = RectPacker.packPages(widths, heights, max_width, max_height, method,
+                                                border_padding, shape_padding, force_square)
+        except ValueError as e:
+            return [], str(e)
+
+        if not pages:
+            return [], "Could not fit any sprites into the specified dimensions!"
+
+        def composite(page):
+            indices, xs, ys, width, height = page
+            packed = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+            packed.fill(self.colorToQt(bg_color) if bg_color else Qt.transparent)
+            rmlSprites = SpriteStore()
+
+            # NOTE: each image is decoded (unless the cache still has it in memory)
+            # right before it's drawn and dropped right after
+            painter = QPainter(packed)
+            try:
+                for k, i in enumerate(indices):
+                    path = files[i][0]
+                    painter.drawImage(xs[k] + inner_padding, ys[k] + inner_padding, self._cache.decode(path))
+                    rmlSprites.add(self.spriteId(path), xs[k], ys[k], widths[i], heights[i])
+            finally:
+                painter.end()
+            return packed, rmlSprites
+
+        # NOTE: painting on a QImage is fine outside the GUI thread, each page has it's own
+        try:
+            with ThreadPoolExecutor(max_workers=min(self._workers or os.cpu_count() or 1, len(pages))) as pool:
+                result = list(pool.map(composite, pages))
+        except (ValueError, OSError) as e:
+            return [], str(e)
+
+        error = None
+        if unfit:
+            error = f"{len(unfit)} sprites are larger than the specified dimensions and were left out!"
+
+        return result, error
 
-            for r in atlas.image_rect_list:
-                # Slice off root folder and path separator
-                p = r.image_path[len(self._path)+1:]
-                p = os.path.splitext(p)[0]
-                id = self.pathToId(p)
-                print(f"Packed sprite {id} ({r.x}, {r.y}, {r.width}, {r.height})")
-                rmlSprites.append(Sprite(id, r.x, r.y, r.width, r.height))
+    def _packPyTexturePacker(self, bg_color, **kwargs):
+        # NOTE: the sizes and pixels come from the cache, so the files are only read
+        # when the cache doesn't have them in memory
+        MythPack.QPILImage.setSource(self._cache)
+        try:
+            images = [ImageRect(path) for path, _ in self._files]
+            packer = Packer.create(**kwargs)
+            # NOTE: one atlas per page
+            atlases = packer._pack(images)
+            pages = []
+            packedCount = 0
+
+            for atlas in atlases:
+                # NOTE: dump_image pastes a copy of each image, which is decoded for the
+                # paste (unless the cache still has it in memory) and dropped right after
+                packed = atlas.dump_image(bg_color)
+                rmlSprites = SpriteStore()
+                for r in atlas.image_rect_list:
+                    rmlSprites.add(self.spriteId(r.image_path), r.x, r.y, r.width, r.height)
+                pages.append((packed.getQImage(), rmlSprites))
+                packedCount += len(rmlSprites)
 
-            if len(rmlSprites) != len(self._images):
+            error = None
+            if packedCount != len(images):
                 error = "Could not fit all sprites into the specified dimensions!"
 
-            return packed.getQImage(), rmlSprites, error
-        except ValueError as e:
-            print(e)
-            return None, None, str(e)
+            return pages, error
+        except (ValueError, OSError) as e:
+            return [], str(e)
+        finally:
+            MythPack.QPILImage.setSource(None)